@@ -0,0 +1,66 @@
+#!/usr/bin/python3
+
+# Compares the file operations of a source code toggle and of fix_mergelist, as they were
+# done with rm subprocesses and as they're done in-process now. Prints the latency saved.
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mintSources import clear_directory, remove_file, write_file_atomically
+
+NB_ROUNDS = 50
+NB_LISTS = 200
+TEMPLATE = "deb http://packages.linuxmint.com vera main upstream import backport\n" * 4
+
+def toggle_with_rm(packages_path, sources_path):
+    # Enabling source code rewrote both official files after an 'rm -f' each, disabling ran another
+    os.system("rm -f %s" % packages_path)
+    with open(packages_path, "w") as text_file:
+        text_file.write(TEMPLATE)
+    os.system("rm -f %s" % sources_path)
+    with open(sources_path, "w") as text_file:
+        text_file.write(TEMPLATE)
+    os.system("rm -f %s" % sources_path)
+
+def toggle_in_process(packages_path, sources_path):
+    write_file_atomically(packages_path, TEMPLATE)
+    write_file_atomically(sources_path, TEMPLATE)
+    remove_file(sources_path)
+
+def clear_with_rm(path):
+    os.system("rm %s/* -vf > /dev/null 2>&1" % path)
+
+def fill_lists(path):
+    for i in range(NB_LISTS):
+        with open(os.path.join(path, "repo%d_dists_jammy_main_binary-amd64_Packages" % i), "w") as list_file:
+            list_file.write("Package: example\n")
+
+def measure(func, *args, setup=None):
+    # Average ms per call
+    total = 0
+    for i in range(NB_ROUNDS):
+        if setup is not None:
+            setup(*args)
+        start = time.time()
+        func(*args)
+        total += time.time() - start
+    return total / NB_ROUNDS * 1000
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp(prefix="mintsources-benchmark-")
+    try:
+        paths = (os.path.join(directory, "official-package-repositories.list"), os.path.join(directory, "official-source-repositories.list"))
+        lists = os.path.join(directory, "lists")
+        os.mkdir(lists)
+        os.mkdir(os.path.join(lists, "partial"))
+        for (name, old, new, args, setup) in [("source code toggle", toggle_with_rm, toggle_in_process, paths, None),
+                                              ("fix_mergelist (%d lists)" % NB_LISTS, clear_with_rm, clear_directory, (lists,), fill_lists)]:
+            old_ms = measure(old, *args, setup=setup)
+            new_ms = measure(new, *args, setup=setup)
+            print("%-26s rm: %7.2f ms  in-process: %7.2f ms  saved: %7.2f ms" % (name, old_ms, new_ms, old_ms - new_ms))
+    finally:
+        shutil.rmtree(directory)
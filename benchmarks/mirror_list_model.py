@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+# Compares writing mirror test results to the mirror list one value at a time against the
+# batched update of MirrorSelectionDialog._flush_results(). A ListStore needs no display.
+
+import collections
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mintSources import Gtk, GdkPixbuf, MirrorSelectionDialog, MIRROR_LIST_BATCH_SIZE, get_speed_label, update_model_rows
+
+NB_MIRRORS = 500
+
+if __name__ == "__main__":
+    speeds = {}
+    for i in range(NB_MIRRORS):
+        speeds["http://mirror%d.example.com/linuxmint" % i] = float((i * 7919) % NB_MIRRORS + 1) * 1024 * 10
+
+    for method in ["per-value", "batched"]:
+        model = Gtk.ListStore(object, str, GdkPixbuf.Pixbuf, float, str, str, str)
+        model.set_sort_column_id(MirrorSelectionDialog.MIRROR_SPEED_COLUMN, Gtk.SortType.DESCENDING)
+        iters = {}
+        for url in speeds:
+            iters[url] = model.append([None, url, None, 0, None, url, url])
+        results = collections.OrderedDict()
+        for (url, speed) in speeds.items():
+            results[url] = {MirrorSelectionDialog.MIRROR_SPEED_COLUMN: speed,
+                            MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: get_speed_label(speed)}
+
+        start = time.time()
+        if method == "per-value":
+            for (url, values) in results.items():
+                for (column, value) in values.items():
+                    model.set_value(iters[url], column, value)
+        else:
+            # Results reach the model in batches, one per update interval
+            urls = list(results.keys())
+            for index in range(0, len(urls), MIRROR_LIST_BATCH_SIZE):
+                update_model_rows(model, iters, dict((url, results[url]) for url in urls[index:index + MIRROR_LIST_BATCH_SIZE]))
+        print("%-10s %4d mirrors  %8.1f ms" % (method, NB_MIRRORS, (time.time() - start) * 1000))
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+# Compares testing every mirror with the full file against the two-phase probe
+# (latency first, then a capped throughput test of the fastest candidates).
+# It uses the mirror lists of this system's mintsources configuration and the network.
+
+import os
+import sys
+import time
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mintSources import get_platform_info, read_mirror_list, sort_mirrors_by_location, get_country_index, get_local_country_code, \
+    MirrorTester, MeasurementCache, SpeedTestPool, SPEED_TEST_WORKERS, MIRROR_CACHE_TTL, MIRROR_CACHE_MAX_ENTRIES, MIRROR_CACHE_FAILURE_TTL
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("--base", dest="base", action="store_true",
+        help="Benchmark the mirrors of the base archive instead of the main one", default=False)
+    (options, args) = parser.parse_args()
+
+    (config, optional_components, system_keys) = get_platform_info().get_mintsources_config()
+    if options.base:
+        mirrors = read_mirror_list(config["mirrors"]["base_mirrors"])
+    else:
+        mirrors = read_mirror_list(config["mirrors"]["mirrors"])
+    workers = int(config["mirrors"].get("speed_test_workers", SPEED_TEST_WORKERS))
+
+    results = []
+    for method in ["full", "two-phase"]:
+        # Start from an empty in-memory cache so both methods do the same work
+        tester = MirrorTester(config, options.base, MeasurementCache(None, MIRROR_CACHE_TTL, MIRROR_CACHE_MAX_ENTRIES, MIRROR_CACHE_FAILURE_TTL))
+        urls = [mirror.url for mirror in sort_mirrors_by_location(mirrors, get_country_index(), get_local_country_code(), tester.default_mirror)]
+        start = time.time()
+        tester.find_default_mirror_age()
+        if method == "full":
+            SpeedTestPool(max_workers=workers).run([(url, tester.speed_test, (url,)) for url in urls])
+        else:
+            tester.probe(urls, SpeedTestPool(max_workers=workers))
+        results.append((method, len(urls), tester.bytes_downloaded, time.time() - start))
+
+    for (method, nb_mirrors, nb_bytes, duration) in results:
+        print("%-10s %4d mirrors  %12d bytes  %7.1f s" % (method, nb_mirrors, nb_bytes, duration))
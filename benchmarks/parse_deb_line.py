@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+
+# Times parse_deb_line() on a large generated sources list, with and without its cache
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mintSources import parse_deb_line
+
+NB_LINES = 100000
+
+if __name__ == "__main__":
+    # Files are re-read on every reload, so the same entries come back many times
+    lines = []
+    for n in range(NB_LINES):
+        i = n % 5000
+        if i % 10 == 0:
+            lines.append("# deb-src http://ppa.launchpad.net/owner%d/ppa/ubuntu jammy main" % i)
+        elif i % 10 == 1:
+            lines.append("deb [arch=amd64 signed-by=/usr/share/keyrings/repo%d.gpg] https://repo%d.example.com/apt stable main # vendor" % (i, i))
+        else:
+            lines.append("deb http://mirror%d.example.com/ubuntu jammy main restricted universe multiverse" % i)
+
+    parse_deb_line.cache_clear()
+    for (method, parse) in [("uncached", parse_deb_line.__wrapped__), ("cached", parse_deb_line)]:
+        start = time.time()
+        for line in lines:
+            parse(line)
+        print("%-10s %6d lines  %8.1f ms" % (method, NB_LINES, (time.time() - start) * 1000))
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+
+# Compares loading the same entries from one-line .list files and from deb822 .sources files
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mintSources import SourcesIndex, parse_deb_line
+
+NB_ENTRIES = 5000
+NB_FILES = 50
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp(prefix="mintsources-benchmark-")
+    try:
+        paths = {".list": [], ".sources": []}
+        for file_number in range(NB_FILES):
+            entries = range(file_number, NB_ENTRIES, NB_FILES)
+            path = os.path.join(directory, "repository%d.list" % file_number)
+            with open(path, "w") as source_file:
+                for i in entries:
+                    source_file.write("# Repository %d\n" % i)
+                    source_file.write("deb [arch=amd64 signed-by=/usr/share/keyrings/repo%d.gpg] http://repo%d.example.com/apt jammy main contrib\n" % (i, i))
+            paths[".list"].append(path)
+            path = os.path.join(directory, "repository%d.sources" % file_number)
+            with open(path, "w") as source_file:
+                for i in entries:
+                    source_file.write("# Repository %d\n" % i)
+                    source_file.write("Types: deb\nURIs: http://repo%d.example.com/apt\nSuites: jammy\nComponents: main contrib\n" % i)
+                    source_file.write("Architectures: amd64\nSigned-By: /usr/share/keyrings/repo%d.gpg\n\n" % i)
+            paths[".sources"].append(path)
+
+        for (extension, files) in paths.items():
+            parse_deb_line.cache_clear()
+            start = time.time()
+            sources_index = SourcesIndex()
+            sources_index.load(files)
+            nb_loaded = 0
+            for source_file in sources_index.files.values():
+                nb_loaded += len(list(source_file.get_entries()))
+            print("%-10s %6d entries in %d files  %8.1f ms" % (extension, nb_loaded, len(files), (time.time() - start) * 1000))
+    finally:
+        shutil.rmtree(directory)
@@ -4,34 +4,72 @@ import os
 import subprocess
 import sys
 import configparser
-import aptsources.distro
-import aptsources.distinfo
-from aptsources.sourceslist import SourcesList
 import gettext
 import threading
-import pycurl
-from io import BytesIO
-from CountryInformation import CountryInformation
+import importlib
 import re
 import json
 import datetime
-from urllib.request import urlopen
-import requests
+import time
+import collections
+import functools
+import hashlib
+import base64
+from urllib.parse import urlparse
 from optparse import OptionParser
 import locale
-import mintcommon
 import unicodedata
-
-import gi
-gi.require_version('Gtk', '3.0')
-gi.require_version('GdkX11', '3.0') # Needed to get xid
-from gi.repository import Gtk, Gdk, GdkPixbuf, GdkX11, GObject, Pango
+import platform
+
+class LazyModule():
+    # Stands for a module (or one of its attributes) which is only imported on first use,
+    # so the command line modes don't load the GUI and network libraries they don't need
+    def __init__(self, name, attribute=None, setup=None):
+        self._name = name
+        self._attribute = attribute
+        self._setup = setup
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            if self._setup is not None:
+                self._setup()
+            module = importlib.import_module(self._name)
+            if self._attribute is not None:
+                module = getattr(module, self._attribute)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __call__(self, *args, **kwargs):
+        return self._load()(*args, **kwargs)
+
+def require_gi_versions():
+    import gi
+    gi.require_version('Gtk', '3.0')
+    gi.require_version('GdkX11', '3.0') # Needed to get xid
+    from gi.repository import GdkX11
+
+Gtk = LazyModule("gi.repository.Gtk", setup=require_gi_versions)
+Gdk = LazyModule("gi.repository.Gdk", setup=require_gi_versions)
+GdkPixbuf = LazyModule("gi.repository.GdkPixbuf", setup=require_gi_versions)
+GObject = LazyModule("gi.repository.GObject", setup=require_gi_versions)
+Gio = LazyModule("gi.repository.Gio", setup=require_gi_versions)
+Pango = LazyModule("gi.repository.Pango", setup=require_gi_versions)
+pycurl = LazyModule("pycurl")
+requests = LazyModule("requests")
+mintcommon = LazyModule("mintcommon")
+CountryInformation = LazyModule("CountryInformation", "CountryInformation")
 
 BUTTON_LABEL_MAX_LENGTH = 30
 
 FLAG_PATH = "/usr/share/iso-flag-png/%s.png"
 FLAG_SIZE = 16
 
+CACHE_DIR = "/var/cache/mintsources"
+
 # i18n
 APP = 'mintsources'
 LOCALE_DIR = "/usr/share/linuxmint/locale"
@@ -41,7 +79,7 @@ gettext.textdomain(APP)
 _ = gettext.gettext
 
 # Used as a decorator to run things in the background
-def async(func):
+def _async(func):
     def wrapper(*args, **kwargs):
         thread = threading.Thread(target=func, args=args, kwargs=kwargs)
         thread.daemon = True
@@ -55,6 +93,22 @@ def idle(func):
         GObject.idle_add(func, *args)
     return wrapper
 
+# Set MINTSOURCES_TIMING to print how long the file operations take
+# (benchmarks/file_operations.py compares them with the rm subprocesses they replaced)
+TIMING = "MINTSOURCES_TIMING" in os.environ
+
+# Used as a decorator to time file operations
+def timed(func):
+    def wrapper(*args, **kwargs):
+        if not TIMING:
+            return func(*args, **kwargs)
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.stderr.write("%s: %.2f ms\n" % (func.__name__, (time.time() - start) * 1000))
+    return wrapper
+
 def remove_repository_via_cli(line, codename, forceYes):
     if line.startswith("ppa:"):
         user, sep, ppa_name = line.split(":")[1].partition("/")
@@ -87,60 +141,48 @@ def remove_repository_via_cli(line, codename, forceYes):
 
         # Remove the PPA from sources.list.d
         try:
-            readfile = open(file, "r")
-            content = readfile.read()
-            readfile.close()
-            content = content.replace(deb_line, "")
-            content = content.replace(debsrc_line, "")
-            with open(file, "w") as writefile:
-                writefile.write(content)
-
-            # If file no longer contains any "deb" instances, delete it as well
-            if "deb " not in content:
-                os.unlink(file)
-        except IOError as detail:
+            source_file = SourceFile(file)
+            for entry in [deb_line, debsrc_line]:
+                line_number = source_file.find_line(entry)
+                if line_number is not None:
+                    source_file.delete_line(line_number)
+            source_file.flush()
+        except (IOError, OSError) as detail:
             print (_("failed to remove PPA: '%s'") % detail)
 
     elif line.startswith("deb ") | line.startswith("http"):
         # Remove the repository from sources.list.d
-        file="/etc/apt/sources.list.d/additional-repositories.list"
         try:
-            readfile = open(file, "r")
-            content = readfile.read()
-            readfile.close()
-            content = content.replace(expand_http_line(line, codename), "")
-            with open(file, "w") as writefile:
-                writefile.write(content)
-
-            # If file no longer contains any "deb" instances, delete it as well
-            if "deb " not in content:
-                os.unlink(file)
-        except IOError as detail:
+            source_file = SourceFile(ADDITIONAL_REPOSITORIES_PATH)
+            line_number = source_file.find_line(expand_http_line(line, codename))
+            if line_number is not None:
+                source_file.delete_line(line_number)
+            source_file.flush()
+        except (IOError, OSError) as detail:
             print (_("failed to remove repository: '%s'") % detail)
 
 
-def add_repository_via_cli(line, codename, forceYes, use_ppas):
-
-    if line.startswith("ppa:"):
-        if use_ppas != "true":
-            print(_("Adding PPAs is not supported"))
-            sys.exit(1)
-        user, sep, ppa_name = line.split(":")[1].partition("/")
-        ppa_name = ppa_name or "ppa"
-        try:
-            ppa_info = get_ppa_info_from_lp(user, ppa_name, codename)
-        except Exception as detail:
-            print (_("Cannot add PPA: '%s'.") % detail)
-            sys.exit(1)
-
-        if "private" in ppa_info and ppa_info["private"]:
-            print(_("Adding private PPAs is not supported currently"))
-            sys.exit(1)
-
-        print(_("You are about to add the following PPA:"))
-        if ppa_info["description"] is not None:
-            print(" %s" % (str(ppa_info["description"]).encode("utf-8","ignore")))
-        print(_(" More info: %s") % str(ppa_info["web_link"]))
+def add_repositories_via_cli(lines, lsb_codename, config, forceYes):
+    # Validates all the lines at once (Launchpad lookups and keys are fetched in parallel), then writes
+    # the sources in one pass. Lines which fail are reported and skipped, the others are still added.
+    transaction = SourcesTransaction(lsb_codename, config, [])
+    for line in lines:
+        transaction.add(line)
+    failures = transaction.check()
+    transaction.discard(failures)
+
+    if len(transaction.operations) > 0:
+        for (action, line, source_code) in transaction.operations:
+            if line in transaction.ppa_info:
+                ppa_info = transaction.ppa_info[line]
+                print(_("You are about to add the following PPA:"))
+                print(" %s" % line)
+                if ppa_info["description"] is not None:
+                    print(" %s" % ppa_info["description"])
+                print(_(" More info: %s") % str(ppa_info["web_link"]))
+            else:
+                print(_("You are about to add the following repository:"))
+                print(" %s" % line)
 
         if sys.stdin.isatty():
             if not(forceYes):
@@ -151,47 +193,685 @@ def add_repository_via_cli(line, codename, forceYes, use_ppas):
                 print(_("Unable to prompt for response.  Please run with -y"))
                 sys.exit(1)
 
-        (deb_line, file) = expand_ppa_line(line.strip(), codename)
-        deb_line = expand_http_line(deb_line, codename)
-        debsrc_line = 'deb-src' + deb_line[3:]
+        # Add the keys
+        key_failures = transaction.fetch_keys()
+        failures.update(key_failures)
+        transaction.discard(key_failures)
+
+        # Add the sources
+        transaction.apply()
+        try:
+            transaction.sources_index.flush()
+        except (IOError, OSError) as detail:
+            for (action, line, source_code) in transaction.operations:
+                failures[line] = _("Cannot save the repositories: '%s'.") % detail
+
+    for line in lines:
+        line = line.strip()
+        if line in failures:
+            print ("[%s] %s: %s" % (_("FAILED"), line, failures[line]))
+        else:
+            print ("[%s] %s" % (_("OK"), line))
+    if len(failures) > 0:
+        sys.exit(1)
 
-        # Add the key
-        short_key = ppa_info["signing_key_fingerprint"][-8:]
-        os.system("apt-key adv --keyserver hkp://keyserver.ubuntu.com:80 --recv-keys %s" % short_key)
+def read_repository_lines(path):
+    # One PPA or repository per line, empty lines and comments are skipped
+    lines = []
+    with open(path, "r") as lines_file:
+        for line in lines_file:
+            line = line.strip()
+            if line != "" and not line.startswith("#"):
+                lines.append(line)
+    return lines
+
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_TIMEOUT = 20
+HTTP_RETRIES = 2
+HTTP_BACKOFF = 0.5
+HTTP_RETRY_STATUSES = (500, 502, 503, 504)
+HTTP_POOL_SIZE = 16
+
+class HttpClient():
+    # All the network access goes through here. API calls use a requests session and mirror measurements
+    # use pooled pycurl handles, so both keep their connections alive between requests to the same host.
+    # Timeouts and retries are the same everywhere, and every transfer is timed, per host.
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT, timeout=HTTP_TIMEOUT, retries=HTTP_RETRIES, backoff=HTTP_BACKOFF):
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.metrics = {}
+        self._handles = []
+        self._lock = threading.Lock()
+
+    def record(self, url, seconds, error=False):
+        host = urlparse(url).netloc
+        with self._lock:
+            metrics = self.metrics.setdefault(host, {"requests": 0, "errors": 0, "seconds": 0.0})
+            metrics["requests"] += 1
+            metrics["seconds"] += seconds
+            if error:
+                metrics["errors"] += 1
+        if TIMING:
+            sys.stderr.write("%s %s: %.2f ms%s\n" % (host, urlparse(url).path, seconds * 1000, " (error)" if error else ""))
+
+    def get_metrics(self):
+        with self._lock:
+            return dict((host, dict(metrics)) for (host, metrics) in self.metrics.items())
+
+    def request(self, method, url, headers=None, timeout=None, retries=None, **kwargs):
+        # Retries connection errors and 5xx answers, waiting longer each time
+        if timeout is None:
+            timeout = self.timeout
+        if retries is None:
+            retries = self.retries
+        for attempt in range(retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * (2 ** (attempt - 1)))
+            start = time.time()
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=(min(self.connect_timeout, timeout), timeout), **kwargs)
+            except requests.RequestException:
+                self.record(url, time.time() - start, error=True)
+                if attempt == retries:
+                    raise
+                continue
+            self.record(url, time.time() - start, error=(response.status_code >= 400))
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == retries:
+                return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def get_curl(self, timeout=None):
+        # A pycurl handle with the common options. Handles given back with release_curl() keep their connections.
+        with self._lock:
+            c = self._handles.pop() if len(self._handles) > 0 else pycurl.Curl()
+        c.setopt(pycurl.CONNECTTIMEOUT, self.connect_timeout)
+        c.setopt(pycurl.TIMEOUT, timeout or self.timeout)
+        c.setopt(pycurl.FOLLOWLOCATION, 1)
+        c.setopt(pycurl.NOSIGNAL, 1)
+        return c
+
+    def release_curl(self, c):
+        # reset() drops the options but not the connection cache
+        c.reset()
+        with self._lock:
+            if len(self._handles) < HTTP_POOL_SIZE:
+                self._handles.append(c)
+                return
+        c.close()
 
-        # Add the PPA in sources.list.d
-        with open(file, "w") as text_file:
-            text_file.write("%s\n" % deb_line)
-            text_file.write("%s\n" % debsrc_line)
-    elif line.startswith("deb ") | line.startswith("http"):
-        with open("/etc/apt/sources.list.d/additional-repositories.list", "a") as text_file:
-            text_file.write("%s\n" % expand_http_line(line, codename))
-
-def get_ppa_info_from_lp(owner_name, ppa_name, base_codename):
-    DEFAULT_KEYSERVER = "hkp://keyserver.ubuntu.com:80/"
-    # maintained until 2015
-    LAUNCHPAD_PPA_API = 'https://launchpad.net/api/1.0/~%s/+archive/%s'
-    # Specify to use the system default SSL store; change to a different path
-    # to test with custom certificates.
-    LAUNCHPAD_PPA_CERT = "/etc/ssl/certs/ca-certificates.crt"
-
-    lp_url = LAUNCHPAD_PPA_API % (owner_name, ppa_name)
-    try:
-        json_data = requests.get(lp_url).json()
-    except pycurl.error as e:
-        raise PPAException("Error reading %s: %s" % (lp_url, e), e)
+    def perform(self, c, url):
+        c.setopt(pycurl.URL, url)
+        start = time.time()
+        try:
+            c.perform()
+        except pycurl.error as detail:
+            # Transfers stopped from a write callback ended on purpose
+            self.record(url, time.time() - start, error=(detail.args[0] != pycurl.E_WRITE_ERROR))
+            raise
+        self.record(url, time.time() - start, error=(c.getinfo(pycurl.RESPONSE_CODE) >= 400))
+
+_http_client = None
+_http_client_lock = threading.Lock()
+
+def get_http_client():
+    # Shared by the whole process, so are its connections
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            _http_client = HttpClient()
+        return _http_client
+
+# maintained until 2015
+LAUNCHPAD_API_URL = "https://launchpad.net/api/1.0"
+PPA_ARCHIVE_URL = "http://ppa.launchpad.net"
+PPA_LOOKUP_TIMEOUT = 10
+
+# Launchpad answers are kept this long (seconds) before being revalidated
+PPA_CACHE_TTL = 24 * 3600
+PPA_CACHE_MAX_ENTRIES = 500
+
+_ppa_cache = None
+_ppa_cache_lock = threading.Lock()
+
+def get_ppa_cache():
+    global _ppa_cache
+    with _ppa_cache_lock:
+        if _ppa_cache is None:
+            _ppa_cache = MeasurementCache(os.path.join(CACHE_DIR, "ppas.json"), PPA_CACHE_TTL, PPA_CACHE_MAX_ENTRIES)
+        return _ppa_cache
+
+def get_ppa_info_from_lp(owner_name, ppa_name, base_codename, cache=None, api_url=LAUNCHPAD_API_URL, archive_url=PPA_ARCHIVE_URL):
+    # The Launchpad description of a PPA, if it supports our base release. Answers are cached,
+    # and revalidated with If-None-Match/If-Modified-Since once they're older than PPA_CACHE_TTL.
+    if cache is None:
+        cache = get_ppa_cache()
+
+    lp_url = "%s/~%s/+archive/%s" % (api_url, owner_name, ppa_name)
+    entry = cache.get(lp_url, "")
+    if cache.is_fresh(entry, "info"):
+        json_data = entry["info"]
+    else:
+        headers = {}
+        if entry is not None and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry is not None and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = get_http_client().get(lp_url, headers=headers, timeout=PPA_LOOKUP_TIMEOUT)
+            if response.status_code == 304 and entry is not None and "info" in entry:
+                json_data = entry["info"]
+            else:
+                response.raise_for_status()
+                json_data = response.json()
+        except Exception as e:
+            raise PPAException("Error reading %s: %s" % (lp_url, e), e)
+        cache.put(lp_url, "", info=json_data,
+                  etag=response.headers.get("ETag", headers.get("If-None-Match")),
+                  last_modified=response.headers.get("Last-Modified", headers.get("If-Modified-Since")))
 
     # Make sure the PPA supports our base release
-    repo_url = "http://ppa.launchpad.net/%s/%s/ubuntu/dists/%s" % (owner_name, ppa_name, base_codename)
-    try:
-        if (urlopen(repo_url).getcode() == 404):
+    repo_url = "%s/%s/%s/ubuntu/dists/%s" % (archive_url, owner_name, ppa_name, base_codename)
+    entry = cache.get(repo_url, base_codename)
+    if cache.is_fresh(entry, "supported"):
+        supported = entry["supported"]
+    else:
+        try:
+            response = get_http_client().head(repo_url, timeout=PPA_LOOKUP_TIMEOUT)
+        except Exception as e:
+            print (e)
+            raise PPAException(_("This PPA does not support %s") % base_codename, e)
+        if response.status_code >= 400 and response.status_code != 404:
             raise PPAException(_("This PPA does not support %s") % base_codename)
-    except Exception as e:
-        print (e)
-        raise PPAException(_("This PPA does not support %s") % base_codename)
+        supported = (response.status_code != 404)
+        cache.put(repo_url, base_codename, supported=supported)
+    cache.save()
 
+    if not supported:
+        raise PPAException(_("This PPA does not support %s") % base_codename)
     return json_data
 
+DEB_LINE_PATTERN = re.compile(r"^\s*(?P<commented>#+\s*)?(?P<line>(?P<type>deb|deb-src)\s+(?:\[(?P<options>[^\]]*)\]\s+)?(?P<uri>cdrom:\[[^\]]*\]\S*|[^\s\[#]\S*)\s+(?P<suite>[^\s#]+)(?P<components>(?:\s+[^\s#]+)*)\s*(?:#.*)?)$")
+
+class DebLine():
+    # One-line-style APT source entry. Instances are shared through the parse cache, treat them as read-only.
+    __slots__ = ("line", "type", "options", "uri", "suite", "components", "commented")
+
+    def __init__(self, line, type, options, uri, suite, components, commented):
+        self.line = line # the entry, without the leading comment marker
+        self.type = type
+        self.options = options # tuple of (key, value)
+        self.uri = uri
+        self.suite = suite
+        self.components = components
+        self.commented = commented
+
+@functools.lru_cache(maxsize=8192)
+def parse_deb_line(text):
+    # Returns a DebLine, or None if the text isn't a deb/deb-src entry
+    match = DEB_LINE_PATTERN.match(text.rstrip())
+    if match is None:
+        return None
+    options = []
+    if match.group("options"):
+        for option in match.group("options").split():
+            (key, sep, value) = option.partition("=")
+            options.append((key, value))
+    return DebLine(match.group("line").rstrip(),
+                   match.group("type"),
+                   tuple(options),
+                   match.group("uri"),
+                   match.group("suite"),
+                   tuple(match.group("components").split()),
+                   match.group("commented") is not None)
+
+ADDITIONAL_REPOSITORIES_PATH = "/etc/apt/sources.list.d/additional-repositories.list"
+
+@timed
+def write_file_atomically(path, content):
+    # Write next to the target and rename over it, so the file is never missing or partial.
+    # Bytes are written as they are, text is encoded.
+    tmp_path = "%s.tmp" % path
+    with open(tmp_path, "wb" if isinstance(content, bytes) else "w") as tmp_file:
+        tmp_file.write(content)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    if os.path.exists(path):
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+    os.rename(tmp_path, path)
+
+@timed
+def remove_file(path):
+    # Returns True if the file was there
+    try:
+        os.unlink(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+@timed
+def clear_directory(path):
+    # Removes the files of a directory, but not its subdirectories. Returns how many were removed.
+    removed = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False):
+                try:
+                    os.unlink(entry.path)
+                    removed += 1
+                except OSError as detail:
+                    print (detail)
+    return removed
+
+def get_file_stat(path):
+    # (mtime, size) of a file, or None if it doesn't exist
+    try:
+        stat = os.stat(path)
+        return (stat.st_mtime, stat.st_size)
+    except OSError:
+        return None
+
+def list_source_files():
+    source_files = []
+    if os.path.exists("/etc/apt/sources.list"):
+        source_files.append("/etc/apt/sources.list")
+    for file in os.listdir("/etc/apt/sources.list.d"):
+        if file.endswith(".list") or file.endswith(".sources"):
+            source_files.append("/etc/apt/sources.list.d/%s" % file)
+
+    if OFFICIAL_PACKAGES_PATH in source_files:
+        source_files.remove(OFFICIAL_PACKAGES_PATH)
+
+    if OFFICIAL_SOURCES_PATH in source_files:
+        source_files.remove(OFFICIAL_SOURCES_PATH)
+
+    return source_files
+
+class SourceException(Exception):
+
+    def __init__(self, value, original_error=None):
+        self.value = value
+        self.original_error = original_error
+
+    def __str__(self):
+        return str(self.value)
+
+class SourceFile():
+    # The lines of an APT source file, edited in memory by line number.
+    # Removed lines become None so that the line numbers held by repositories stay valid.
+    def __init__(self, path):
+        self.path = path
+        self.lines = []
+        self.dirty = False
+        self.stat = None
+        if os.path.exists(path):
+            self.stat = get_file_stat(path)
+            with open(path, "r") as source_file:
+                self._read(source_file)
+
+    def _read(self, source_file):
+        self.lines = [line.rstrip("\n") for line in source_file]
+
+    def get_entries(self):
+        # Yields (line number, deb line, enabled) for every entry in the file
+        for (line_number, line) in enumerate(self.lines):
+            if line is None:
+                continue
+            deb = parse_deb_line(line)
+            if deb is not None:
+                yield (line_number, deb.line, not deb.commented)
+
+    def has_changed_on_disk(self):
+        return get_file_stat(self.path) != self.stat
+
+    def set_entry_enabled(self, line_number, line, enabled):
+        if enabled:
+            self.set_line(line_number, line)
+        else:
+            self.set_line(line_number, "# %s" % line)
+
+    def edit_entry(self, line_number, line, new_line):
+        # Returns the entry as it now reads
+        self.set_line(line_number, self.lines[line_number].replace(line, new_line, 1))
+        return new_line
+
+    def set_line(self, line_number, text):
+        if self.lines[line_number] != text:
+            self.lines[line_number] = text
+            self.dirty = True
+
+    def delete_line(self, line_number):
+        self.lines[line_number] = None
+        self.dirty = True
+
+    def append_line(self, text):
+        self.lines.append(text)
+        self.dirty = True
+        return len(self.lines) - 1
+
+    def find_line(self, text):
+        # Returns the number of the line holding this entry, enabled or not, or None
+        for (line_number, line, selected) in self.get_entries():
+            if line == text:
+                return line_number
+        return None
+
+    def has_entries(self):
+        for line in self.lines:
+            if line is not None and "deb" in line:
+                return True
+        return False
+
+    def flush(self):
+        if not self.dirty:
+            return False
+        if self.has_entries():
+            write_file_atomically(self.path, self.render())
+        else:
+            # If the file no longer contains any "deb" instances, delete it as well
+            remove_file(self.path)
+        self.dirty = False
+        # Remember what we wrote, so the watcher doesn't take it for an outside change
+        self.stat = get_file_stat(self.path)
+        return True
+
+    def render(self):
+        return "".join("%s\n" % line for line in self.lines if line is not None)
+
+# deb822 fields which map to one-line options, when their names differ
+DEB822_OPTIONS = {"architectures": "arch", "languages": "lang", "targets": "target"}
+DEB822_OPTION_FIELDS = dict((option, field) for (field, option) in DEB822_OPTIONS.items())
+DEB822_ENTRY_FIELDS = ["types", "uris", "suites", "components", "enabled"]
+
+class Deb822Stanza():
+    # The raw lines of a deb822 paragraph (with the blank lines following it), and where each field sits in them
+    def __init__(self):
+        self.lines = []
+        self.fields = collections.OrderedDict()
+
+    def index(self):
+        # Maps the lowercased field name to [name, first line, line after the last continuation line]
+        self.fields = collections.OrderedDict()
+        field = None
+        for (line_number, line) in enumerate(self.lines):
+            if line.strip() == "":
+                break
+            if line.startswith("#"):
+                continue
+            if line[0] in " \t":
+                if field is not None:
+                    field[2] = line_number + 1
+                continue
+            (name, sep, value) = line.partition(":")
+            if sep:
+                field = [name.strip(), line_number, line_number + 1]
+                self.fields[name.strip().lower()] = field
+
+    def get(self, name, default=None):
+        field = self.fields.get(name.lower())
+        if field is None:
+            return default
+        (first, end) = field[1:]
+        values = [self.lines[first].partition(":")[2].strip()]
+        for line in self.lines[first + 1:end]:
+            values.append(line.strip())
+        return "\n".join(values).strip()
+
+    def set(self, name, value):
+        field = self.fields.get(name.lower())
+        if field is not None:
+            self.lines[field[1]:field[2]] = ["%s: %s" % (field[0], value)]
+        else:
+            position = 0
+            for (line_number, line) in enumerate(self.lines):
+                if line.strip() == "":
+                    break
+                position = line_number + 1
+            self.lines.insert(position, "%s: %s" % (name, value))
+        self.index()
+
+    def remove(self, name):
+        field = self.fields.get(name.lower())
+        if field is not None:
+            del self.lines[field[1]:field[2]]
+            self.index()
+
+    def get_combinations(self):
+        # Every (type, URI, suite) the stanza describes, each of them is an entry of its own
+        combinations = []
+        for type in self.get("Types", "").split():
+            for uri in self.get("URIs", "").split():
+                for suite in self.get("Suites", "").split():
+                    combinations.append((type, uri, suite))
+        return combinations
+
+    def get_entries(self):
+        # The stanza written as one-line entries, in the order of get_combinations()
+        options = []
+        for (key, field) in self.fields.items():
+            if key not in DEB822_ENTRY_FIELDS:
+                value = self.get(key)
+                if "\n" not in value:
+                    # Inline keys can't be written on one line
+                    options.append("%s=%s" % (DEB822_OPTIONS.get(key, key), ",".join(value.split())))
+        components = self.get("Components", "").split()
+        entries = []
+        for (type, uri, suite) in self.get_combinations():
+            elements = [type]
+            if len(options) > 0:
+                elements.append("[%s]" % " ".join(options))
+            elements += [uri, suite] + components
+            entries.append(parse_deb_line(" ".join(elements)))
+        return entries
+
+    def split(self):
+        # One stanza per entry, with the same options. Comments stay with the first one.
+        body = []
+        trailer = []
+        for line in self.lines:
+            if len(trailer) > 0 or line.strip() == "":
+                trailer.append(line)
+            else:
+                body.append(line)
+        stanzas = []
+        for (type, uri, suite) in self.get_combinations():
+            stanza = Deb822Stanza()
+            stanza.lines = [line for line in body if len(stanzas) == 0 or not line.startswith("#")] + [""]
+            stanza.index()
+            stanza.set("Types", type)
+            stanza.set("URIs", uri)
+            stanza.set("Suites", suite)
+            stanzas.append(stanza)
+        # The last one is followed by whatever followed the original stanza
+        stanzas[-1].lines = stanzas[-1].lines[:-1] + trailer
+        return stanzas
+
+    def is_enabled(self):
+        return self.get("Enabled", "yes").lower() != "no"
+
+class Deb822SourceFile(SourceFile):
+    # A deb822 .sources file. A stanza holds one entry per (type, URI, suite), numbered
+    # (position of the stanza in the file, position of the entry in the stanza).
+    # Stanzas are only rewritten where they're modified, the rest is written back as it was read.
+    # Modifying one entry of a stanza which holds several splits it into one stanza per entry,
+    # kept together in a list at the position of the original stanza so that the numbers don't change.
+    def __init__(self, path):
+        self.stanzas = []
+        SourceFile.__init__(self, path)
+
+    def _read(self, source_file):
+        self.stanzas = []
+        stanza = Deb822Stanza()
+        ended = False
+        for line in source_file:
+            line = line.rstrip("\n")
+            if line.strip() == "":
+                ended = True
+            elif ended:
+                stanza.index()
+                self.stanzas.append(stanza)
+                stanza = Deb822Stanza()
+                ended = False
+            stanza.lines.append(line)
+        if len(stanza.lines) > 0:
+            stanza.index()
+            self.stanzas.append(stanza)
+
+    def _get_stanzas(self):
+        # Yields (stanza number, entry number of its first entry, stanza) for every stanza left
+        for (stanza_number, stanza) in enumerate(self.stanzas):
+            if isinstance(stanza, list):
+                for (entry_number, part) in enumerate(stanza):
+                    if part is not None:
+                        yield (stanza_number, entry_number, part)
+            elif stanza is not None:
+                yield (stanza_number, 0, stanza)
+
+    def _get_stanza(self, entry_number):
+        # The stanza holding this entry alone, the one holding it is split if needed
+        (stanza_number, index) = entry_number
+        stanza = self.stanzas[stanza_number]
+        if not isinstance(stanza, list):
+            if len(stanza.get_combinations()) == 1:
+                return stanza
+            stanza = stanza.split()
+            self.stanzas[stanza_number] = stanza
+        return stanza[index]
+
+    def get_entries(self):
+        for (stanza_number, first_entry, stanza) in self._get_stanzas():
+            for (index, deb) in enumerate(stanza.get_entries()):
+                yield ((stanza_number, first_entry + index), deb.line, stanza.is_enabled())
+
+    def set_entry_enabled(self, entry_number, line, enabled):
+        stanza = self.stanzas[entry_number[0]]
+        if isinstance(stanza, list) or stanza.is_enabled() != enabled:
+            stanza = self._get_stanza(entry_number)
+            if stanza.is_enabled() != enabled:
+                stanza.set("Enabled", "yes" if enabled else "no")
+                self.dirty = True
+
+    def edit_entry(self, entry_number, line, new_line):
+        # Only the fields which were edited are rewritten. Raises SourceException if the edit can't be written as deb822.
+        (old, new) = (parse_deb_line(line), parse_deb_line(new_line))
+        if new is None:
+            raise SourceException(_("Invalid repository: '%s'.") % new_line)
+        if old is None or old.line == new.line:
+            return line
+        (old_options, new_options) = (dict(old.options), dict(new.options))
+        for key in new_options:
+            if DEB822_OPTION_FIELDS.get(key, key) in DEB822_ENTRY_FIELDS:
+                raise SourceException(_("Invalid repository: '%s'.") % new_line)
+        stanza = self._get_stanza(entry_number)
+        for (name, old_value, new_value) in [("Types", old.type, new.type), ("URIs", old.uri, new.uri), ("Suites", old.suite, new.suite)]:
+            if old_value != new_value:
+                stanza.set(name, new_value)
+        if old.components != new.components:
+            stanza.set("Components", " ".join(new.components))
+        # Options map to fields, e.g. [arch=amd64,i386] to "Architectures: amd64 i386"
+        for key in old_options:
+            if key not in new_options:
+                stanza.remove(DEB822_OPTION_FIELDS.get(key, key))
+        for (key, value) in new_options.items():
+            if old_options.get(key) != value:
+                name = "-".join(part.capitalize() for part in DEB822_OPTION_FIELDS.get(key, key).split("-"))
+                stanza.set(name, " ".join(value.split(",")))
+        self.dirty = True
+        return stanza.get_entries()[0].line
+
+    def delete_line(self, entry_number):
+        (stanza_number, index) = entry_number
+        if isinstance(self.stanzas[stanza_number], list) or len(self.stanzas[stanza_number].get_combinations()) > 1:
+            self._get_stanza(entry_number)
+            self.stanzas[stanza_number][index] = None
+        else:
+            self.stanzas[stanza_number] = None
+        self.dirty = True
+
+    def has_entries(self):
+        for (stanza_number, first_entry, stanza) in self._get_stanzas():
+            if len(stanza.get_combinations()) > 0:
+                return True
+        return False
+
+    def render(self):
+        return "".join("%s\n" % line for (stanza_number, first_entry, stanza) in self._get_stanzas() for line in stanza.lines)
+
+def open_source_file(path):
+    if path.endswith(".sources"):
+        return Deb822SourceFile(path)
+    return SourceFile(path)
+
+class SourcesIndex():
+    # All the APT source files we know about, by path
+    def __init__(self):
+        self.files = {}
+
+    def load(self, paths):
+        for path in paths:
+            self.files[path] = open_source_file(path)
+
+    def get_file(self, path):
+        if path not in self.files:
+            self.files[path] = open_source_file(path)
+        return self.files[path]
+
+    def remove_file(self, path):
+        return self.files.pop(path, None)
+
+    def flush(self):
+        # Only the files which changed are written
+        flushed = []
+        for source_file in self.files.values():
+            if source_file.flush():
+                flushed.append(source_file.path)
+        return flushed
+
+# Seconds between two checks of the source files, when inotify isn't available
+SOURCES_POLL_INTERVAL = 5
+
+class SourcesWatcher():
+    # Calls back (from the main loop) when APT source files change. Uses inotify
+    # through Gio file monitors, or polls when they can't be set up.
+    def __init__(self, paths, callback):
+        self.callback = callback
+        self._monitors = []
+        self._queued = False
+        try:
+            for path in paths:
+                monitor = Gio.File.new_for_path(path).monitor(Gio.FileMonitorFlags.NONE, None)
+                monitor.connect("changed", self._on_changed)
+                self._monitors.append(monitor)
+        except Exception as detail:
+            print ("Cannot watch the APT sources, polling them instead: %s" % detail)
+            self._monitors = []
+            GObject.timeout_add_seconds(SOURCES_POLL_INTERVAL, self._on_poll)
+
+    def _on_changed(self, monitor, file, other_file, event_type):
+        # A single write fires several events, handle them together
+        if not self._queued:
+            self._queued = True
+            GObject.timeout_add(500, self._notify)
+
+    def _on_poll(self):
+        self.callback()
+        return True
+
+    def _notify(self):
+        self._queued = False
+        self.callback()
+        return False
+
 def encode(s):
     return re.sub("[^a-zA-Z0-9_-]", "_", s)
 
@@ -229,6 +909,591 @@ def expand_http_line(line, distro_codename):
     line = "deb %s %s %s" % ( repo, distro_codename, areas )
     return line
 
+def read_mintsources_config(lsb_codename):
+    # Returns the config sections, the optional components as (name, description) and the system keys
+    config_parser = configparser.RawConfigParser()
+    config_parser.read("/usr/share/mintsources/%s/mintsources.conf" % lsb_codename)
+    config = {}
+    optional_components = []
+    system_keys = []
+    for section in config_parser.sections():
+        if section.startswith("optional_component"):
+            optional_components.append((config_parser.get(section, "name"), config_parser.get(section, "description")))
+        elif section.startswith("key"):
+            system_keys.append(config_parser.get(section, "pub"))
+        else:
+            config[section] = {}
+            for param in config_parser.options(section):
+                config[section][param] = config_parser.get(section, param)
+    return (config, optional_components, system_keys)
+
+LSB_RELEASE_PATH = "/etc/lsb-release"
+OS_RELEASE_PATH = "/etc/os-release"
+DPKG_ARCH_PATH = "/var/lib/dpkg/arch"
+
+# platform.machine() to dpkg architecture, for when dpkg's arch file isn't there
+DPKG_ARCHITECTURES = {"x86_64": "amd64", "i386": "i386", "i486": "i386", "i586": "i386", "i686": "i386",
+                      "aarch64": "arm64", "armv7l": "armhf", "armv6l": "armel", "ppc64le": "ppc64el",
+                      "s390x": "s390x", "riscv64": "riscv64"}
+
+def read_key_values(path):
+    # KEY=value files such as os-release, with the quotes removed
+    values = {}
+    try:
+        with open(path, "r") as key_values_file:
+            for line in key_values_file:
+                (key, sep, value) = line.strip().partition("=")
+                if sep and not key.startswith("#"):
+                    values[key.strip()] = value.strip().strip("\"'")
+    except (IOError, OSError):
+        pass
+    return values
+
+class PlatformInfo():
+    # The distribution codename, the dpkg architecture and mintsources.conf, read from files
+    # once per process instead of forking lsb_release and dpkg every time they're needed
+    def __init__(self):
+        self._codename = None
+        self._architecture = None
+        self._configs = {}
+        self._lock = threading.Lock()
+
+    def get_codename(self):
+        # Same answer as lsb_release -sc, which reads /etc/lsb-release first
+        with self._lock:
+            if self._codename is None:
+                codename = read_key_values(LSB_RELEASE_PATH).get("DISTRIB_CODENAME")
+                if not codename:
+                    codename = read_key_values(OS_RELEASE_PATH).get("VERSION_CODENAME")
+                if not codename:
+                    codename = subprocess.getoutput("lsb_release -sc")
+                self._codename = codename
+            return self._codename
+
+    def get_architecture(self):
+        # Same answer as dpkg --print-architecture. The arch file lists the native architecture first.
+        with self._lock:
+            if self._architecture is None:
+                architecture = None
+                try:
+                    with open(DPKG_ARCH_PATH, "r") as arch_file:
+                        architecture = arch_file.readline().strip()
+                except (IOError, OSError):
+                    pass
+                if not architecture:
+                    machine = platform.machine()
+                    architecture = DPKG_ARCHITECTURES.get(machine, machine)
+                self._architecture = architecture
+            return self._architecture
+
+    def get_mintsources_config(self, codename=None):
+        # (config, optional components, system keys), parsed once per codename
+        if codename is None:
+            codename = self.get_codename()
+        with self._lock:
+            if codename not in self._configs:
+                self._configs[codename] = read_mintsources_config(codename)
+            return self._configs[codename]
+
+_platform_info = None
+
+def get_platform_info():
+    global _platform_info
+    if _platform_info is None:
+        _platform_info = PlatformInfo()
+    return _platform_info
+
+OFFICIAL_PACKAGES_PATH = "/etc/apt/sources.list.d/official-package-repositories.list"
+OFFICIAL_SOURCES_PATH = "/etc/apt/sources.list.d/official-source-repositories.list"
+
+OFFICIAL_TEMPLATE_PLACEHOLDER = re.compile(r"\$(optionalcomponents|basecodename|basemirror|codename|mirror)")
+
+@functools.lru_cache(maxsize=16)
+def compile_template(template_path, stat):
+    # Splits a template into literal text and placeholder names, rendering is then a single join.
+    # The stat is part of the cache key, so an updated template gets compiled again.
+    with open(template_path, 'r') as template_file:
+        parts = OFFICIAL_TEMPLATE_PLACEHOLDER.split(template_file.read())
+    # Odd indexes hold placeholder names
+    return tuple(parts)
+
+def render_official_sources(template_path, config, selected_components, mirror, base_mirror):
+    values = {"codename": config["general"]["codename"],
+              "basecodename": config["general"]["base_codename"],
+              "optionalcomponents": ' '.join(selected_components),
+              "mirror": mirror,
+              "basemirror": base_mirror}
+    parts = compile_template(template_path, get_file_stat(template_path))
+    return "".join(values[part] if index % 2 else part for (index, part) in enumerate(parts))
+
+def read_file(path):
+    # The content of a file, or None if it can't be read
+    try:
+        with open(path, "r") as text_file:
+            return text_file.read()
+    except (IOError, OSError):
+        return None
+
+@timed
+def write_official_sources(lsb_codename, config, selected_components, mirror, base_mirror, source_code):
+    # Returns True if any file changed. Files which already hold the right content are left alone.
+    changed = False
+
+    # Update official packages repositories
+    template = render_official_sources('/usr/share/mintsources/%s/official-package-repositories.list' % lsb_codename, config, selected_components, mirror, base_mirror)
+    if read_file(OFFICIAL_PACKAGES_PATH) != template:
+        write_file_atomically(OFFICIAL_PACKAGES_PATH, template)
+        changed = True
+
+    # Update official sources repositories
+    if source_code:
+        template = render_official_sources('/usr/share/mintsources/%s/official-source-repositories.list' % lsb_codename, config, selected_components, mirror, base_mirror)
+        if read_file(OFFICIAL_SOURCES_PATH) != template:
+            write_file_atomically(OFFICIAL_SOURCES_PATH, template)
+            changed = True
+    elif remove_file(OFFICIAL_SOURCES_PATH):
+        changed = True
+
+    return changed
+
+def read_official_sources(config, component_names):
+    # Returns the selected mirror, base mirror, enabled optional components and whether source code is enabled
+    selected_mirror = config["mirrors"]["default"]
+    selected_base_mirror = config["mirrors"]["base_default"]
+    selected_components = []
+
+    listfile = open(OFFICIAL_PACKAGES_PATH, 'r')
+    for line in listfile.readlines():
+        deb = parse_deb_line(line)
+        if deb is None:
+            continue
+        if (config["detection"]["main_identifier"] in line):
+            for component_name in component_names:
+                if component_name in deb.components and component_name not in selected_components:
+                    selected_components.append(component_name)
+            if deb.type == "deb" and not deb.commented:
+                if "$" not in deb.uri:
+                    selected_mirror = deb.uri.rstrip('/')
+        if (config["detection"]["base_identifier"] in line):
+            if deb.type == "deb" and not deb.commented:
+                if "$" not in deb.uri:
+                    selected_base_mirror = deb.uri.rstrip('/')
+    listfile.close()
+
+    return (selected_mirror, selected_base_mirror, selected_components, os.path.exists(OFFICIAL_SOURCES_PATH))
+
+class SourcesTransaction():
+    # Changes to the APT sources, queued, then checked and applied together.
+    # Each touched file is written once, and the APT cache is refreshed once at the end.
+    def __init__(self, lsb_codename, config, component_names, sources_index=None):
+        self.lsb_codename = lsb_codename
+        self.config = config
+        self.codename = config["general"]["base_codename"]
+        self.component_names = component_names
+        if sources_index is None:
+            sources_index = SourcesIndex()
+            sources_index.load(list_source_files())
+        self.sources_index = sources_index
+        self.operations = []
+        self.official_sources = None
+        self.ppa_info = {}
+        self.touched_files = []
+
+    def add(self, line, source_code=True):
+        # A PPA (ppa:owner/name) or a repository line. The deb-src line of a PPA is added disabled unless source_code is set.
+        self.operations.append(("add", line.strip(), source_code))
+
+    def remove(self, line):
+        self.operations.append(("remove", line.strip(), None))
+
+    def set_enabled(self, line, enabled):
+        self.operations.append(("enable" if enabled else "disable", line.strip(), None))
+
+    def set_official_sources(self, selected_components, mirror, base_mirror, source_code):
+        self.official_sources = (selected_components, mirror, base_mirror, source_code)
+
+    def is_empty(self):
+        return len(self.operations) == 0 and self.official_sources is None
+
+    def get_plan(self):
+        plan = ["%s %s" % (action, line) for (action, line, source_code) in self.operations]
+        if self.official_sources is not None:
+            (selected_components, mirror, base_mirror, source_code) = self.official_sources
+            plan.append("official mirror=%s base_mirror=%s components=%s source_code=%s" % (mirror, base_mirror, ",".join(selected_components), source_code))
+        return plan
+
+    def get_deb_lines(self, line):
+        # The entries a PPA or repository line stands for, as they're written in the source files
+        return [deb_line for (deb_line, file) in self._expand(line.strip())]
+
+    def is_enabled(self, line):
+        # True or False if the sources have this PPA (its deb line) or repository, None if they don't
+        (deb_line, file) = self._expand(line.strip())[0]
+        (source_file, line_number) = self._find(deb_line, file)
+        if source_file is None:
+            return None
+        for (number, entry, selected) in source_file.get_entries():
+            if number == line_number:
+                return selected
+        return None
+
+    def _expand(self, line):
+        # Returns the [(deb line, file)] a queued line stands for. The file is None when the entry can be anywhere.
+        if line.startswith("ppa:"):
+            (deb_line, file) = expand_ppa_line(line, self.codename)
+            deb_line = expand_http_line(deb_line, self.codename)
+            return [(deb_line, file), ('deb-src' + deb_line[3:], file)]
+        return [(expand_http_line(line, self.codename), None)]
+
+    def _find(self, deb_line, file):
+        # (source file, line number) of an entry, enabled or not, or (None, None).
+        # The file an entry is expected in is searched first, then all of them, since it may
+        # have been added elsewhere (a PPA in a deb822 .sources file, for instance).
+        source_files = list(self.sources_index.files.values())
+        if file is not None:
+            expected_file = self.sources_index.get_file(file)
+            source_files = [expected_file] + [source_file for source_file in source_files if source_file is not expected_file]
+        for source_file in source_files:
+            line_number = source_file.find_line(deb_line)
+            if line_number is not None:
+                return (source_file, line_number)
+        return (None, None)
+
+    def lookup_ppas(self):
+        # Fetches the Launchpad info of the PPAs being added, all at once. Returns {line: error}.
+        lookup_errors = {}
+        def lookup(line):
+            user, sep, ppa_name = line.split(":")[1].partition("/")
+            try:
+                self.ppa_info[line] = get_ppa_info_from_lp(user, ppa_name or "ppa", self.codename)
+            except Exception as detail:
+                lookup_errors[line] = detail
+        threads = []
+        for (action, line, source_code) in self.operations:
+            if action == "add" and line.startswith("ppa:") and line not in self.ppa_info and line.split(":")[1].partition("/")[0] != "":
+                thread = threading.Thread(target=lookup, args=(line,))
+                thread.start()
+                threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return lookup_errors
+
+    def check(self):
+        # Returns {queued line: error message} for the operations which can't be done
+        failures = collections.OrderedDict()
+        lookup_errors = {}
+        if self.config["general"]["use_ppas"] == "true":
+            lookup_errors = self.lookup_ppas()
+        for (action, line, source_code) in self.operations:
+            if line.startswith("ppa:"):
+                user, sep, ppa_name = line.split(":")[1].partition("/")
+                if user == "":
+                    failures[line] = _("Invalid PPA: '%s'.") % line
+                    continue
+                if action == "add":
+                    if self.config["general"]["use_ppas"] != "true":
+                        failures[line] = _("Adding PPAs is not supported")
+                        continue
+                    if line in lookup_errors:
+                        failures[line] = _("Cannot add PPA: '%s'.") % lookup_errors[line]
+                        continue
+                    if self.ppa_info[line].get("private"):
+                        failures[line] = _("Adding private PPAs is not supported currently")
+                        continue
+            elif action == "add":
+                deb = parse_deb_line(expand_http_line(line, self.codename))
+                if deb is None or deb.commented:
+                    failures[line] = _("Invalid repository: '%s'.") % line
+                    continue
+            if action != "add":
+                (deb_line, file) = self._expand(line)[0]
+                if self._find(deb_line, file)[0] is None:
+                    failures[line] = _("Repository not found: '%s'.") % line
+        return failures
+
+    def validate(self):
+        # Returns a list of error messages, empty if the transaction can be committed
+        errors = list(self.check().values())
+        if self.official_sources is not None:
+            (selected_components, mirror, base_mirror, source_code) = self.official_sources
+            for component_name in selected_components:
+                if component_name not in self.component_names:
+                    errors.append(_("Unknown component: '%s'.") % component_name)
+            if not mirror or not base_mirror:
+                errors.append(_("No mirror selected."))
+        return errors
+
+    def discard(self, lines):
+        # Drops the operations on these lines, e.g. the ones which failed
+        self.operations = [operation for operation in self.operations if operation[1] not in lines]
+
+    def apply(self):
+        # Makes the queued changes to the source files, in memory. Call validate() first.
+        for (action, line, source_code) in self.operations:
+            entries = self._expand(line)
+            if action == "remove":
+                for (deb_line, file) in entries:
+                    (source_file, line_number) = self._find(deb_line, file)
+                    if source_file is not None:
+                        source_file.delete_line(line_number)
+                        self._touch(source_file)
+                continue
+            # Enabling or disabling a PPA doesn't change its deb-src line
+            if action != "add":
+                entries = entries[:1]
+            for (deb_line, file) in entries:
+                enabled = (action != "disable")
+                if action == "add" and deb_line.startswith("deb-src"):
+                    enabled = source_code
+                (source_file, line_number) = self._find(deb_line, file)
+                if source_file is not None:
+                    source_file.set_entry_enabled(line_number, deb_line, enabled)
+                else:
+                    source_file = self.sources_index.get_file(file or ADDITIONAL_REPOSITORIES_PATH)
+                    source_file.append_line(deb_line if enabled else "# %s" % deb_line)
+                self._touch(source_file)
+
+    def _touch(self, source_file):
+        if source_file not in self.touched_files:
+            self.touched_files.append(source_file)
+
+    def get_keys(self):
+        # {fingerprint: [queued lines]} for the signing keys of the PPAs being added, several PPAs can share a key
+        keys = collections.OrderedDict()
+        for (action, line, source_code) in self.operations:
+            if action == "add" and line in self.ppa_info:
+                keys.setdefault(self.ppa_info[line]["signing_key_fingerprint"], []).append(line)
+        return keys
+
+    def fetch_keys(self):
+        # Returns {queued line: error message} for the keys which couldn't be installed
+        failures = {}
+        keys = self.get_keys()
+        if len(keys) > 0:
+            for (key_id, error) in KeyFetcher().install(list(keys.keys())).items():
+                for line in keys[key_id]:
+                    failures[line] = error
+        return failures
+
+    def commit(self, refresh=None):
+        # Returns the list of errors. Nothing is written unless the whole transaction is valid.
+        errors = self.validate()
+        if len(errors) > 0:
+            return errors
+        # Without its key, a new PPA would break apt update, so the keys come first
+        errors = list(self.fetch_keys().values())
+        if len(errors) > 0:
+            return errors
+        self.apply()
+        flushed = self.sources_index.flush()
+        if self.official_sources is not None:
+            (selected_components, mirror, base_mirror, source_code) = self.official_sources
+            if write_official_sources(self.lsb_codename, self.config, selected_components, mirror, base_mirror, source_code):
+                flushed.append(OFFICIAL_PACKAGES_PATH)
+        if len(flushed) > 0 and refresh is not None:
+            refresh()
+        return []
+
+def refresh_apt_cache():
+    subprocess.call(["apt-get", "update"])
+
+# A manifest lists PPAs or repository lines under "add", "remove", "enable" and "disable", and can set
+# the official sources with an "official" object ("mirror", "base_mirror", "components", "source_code").
+# The same manifest works for both modes: "batch" makes every listed change, "sync" only makes the
+# changes the sources still need (and with --prune, removes what the manifest doesn't list).
+MANIFEST_LISTS = ["add", "remove", "enable", "disable"]
+MANIFEST_OFFICIAL_KEYS = ["mirror", "base_mirror", "components", "source_code"]
+
+def read_manifest(path):
+    # JSON, or YAML when the file is named so and PyYAML is installed
+    try:
+        with open(path, "r") as manifest_file:
+            if path.endswith(".yaml") or path.endswith(".yml"):
+                import yaml
+                manifest = yaml.safe_load(manifest_file)
+            else:
+                manifest = json.load(manifest_file)
+    except ImportError:
+        print (_("Reading YAML manifests requires PyYAML (python3-yaml)."))
+        sys.exit(1)
+    except Exception as detail:
+        print (_("Cannot read the manifest: '%s'.") % detail)
+        sys.exit(1)
+    if not isinstance(manifest, dict):
+        print (_("Cannot read the manifest: '%s'.") % path)
+        sys.exit(1)
+    # Keys written without a value (e.g. "add:" in YAML) are read as None, they're empty
+    for key in MANIFEST_LISTS:
+        if manifest.get(key) is None:
+            manifest[key] = []
+        elif not isinstance(manifest[key], list) or not all(isinstance(line, str) for line in manifest[key]):
+            print (_("Cannot read the manifest: '%s' must be a list of PPAs or repositories.") % key)
+            sys.exit(1)
+    if manifest.get("official") is None:
+        manifest["official"] = {}
+    elif not isinstance(manifest["official"], dict):
+        print (_("Cannot read the manifest: '%s' must be an object.") % "official")
+        sys.exit(1)
+    for key in MANIFEST_OFFICIAL_KEYS:
+        if key in manifest["official"] and manifest["official"][key] is None:
+            del manifest["official"][key]
+    return manifest
+
+def get_manifest_official_sources(manifest, config, component_names):
+    # (components, mirror, base_mirror, source_code) as the manifest wants them, the current
+    # settings filling in what it doesn't give, or None if it doesn't mention the official sources
+    official = manifest["official"]
+    if len(official) == 0:
+        return None
+    (mirror, base_mirror, selected_components, source_code) = read_official_sources(config, component_names)
+    return (official.get("components", selected_components),
+            official.get("mirror", mirror).rstrip("/"),
+            official.get("base_mirror", base_mirror).rstrip("/"),
+            official.get("source_code", source_code))
+
+def apply_manifest_via_cli(lsb_codename, manifest_path):
+    # Makes every change the manifest lists
+    (config, optional_components, system_keys) = get_platform_info().get_mintsources_config(lsb_codename)
+    component_names = [name for (name, description) in optional_components]
+    manifest = read_manifest(manifest_path)
+
+    transaction = SourcesTransaction(lsb_codename, config, component_names)
+    for line in manifest["add"]:
+        transaction.add(line)
+    for line in manifest["remove"]:
+        transaction.remove(line)
+    for line in manifest["enable"]:
+        transaction.set_enabled(line, True)
+    for line in manifest["disable"]:
+        transaction.set_enabled(line, False)
+    official_sources = get_manifest_official_sources(manifest, config, component_names)
+    if official_sources is not None:
+        transaction.set_official_sources(*official_sources)
+
+    errors = transaction.commit(refresh=refresh_apt_cache)
+    for error in errors:
+        print (error)
+    if len(errors) > 0:
+        sys.exit(1)
+
+def sync_manifest_via_cli(lsb_codename, manifest_path, dry_run, prune):
+    # Takes the manifest as the wanted state and only makes the changes the sources need,
+    # so PPAs which are already there cost no network access
+    (config, optional_components, system_keys) = get_platform_info().get_mintsources_config(lsb_codename)
+    component_names = [name for (name, description) in optional_components]
+    manifest = read_manifest(manifest_path)
+    transaction = SourcesTransaction(lsb_codename, config, component_names)
+
+    for line in manifest["add"]:
+        enabled = transaction.is_enabled(line)
+        if enabled is None:
+            transaction.add(line)
+        elif not enabled:
+            transaction.set_enabled(line, True)
+    for line in manifest["remove"]:
+        if transaction.is_enabled(line) is not None:
+            transaction.remove(line)
+    # A missing repository can't be enabled or disabled, the transaction reports it
+    for (key, wanted) in [("enable", True), ("disable", False)]:
+        for line in manifest[key]:
+            if transaction.is_enabled(line) != wanted:
+                transaction.set_enabled(line, wanted)
+
+    if prune:
+        wanted_lines = []
+        for line in manifest["add"] + manifest["enable"] + manifest["disable"]:
+            wanted_lines += transaction.get_deb_lines(line)
+        for source_file in list(transaction.sources_index.files.values()):
+            for (line_number, line, selected) in source_file.get_entries():
+                if line not in wanted_lines:
+                    transaction.remove(line)
+
+    official_sources = get_manifest_official_sources(manifest, config, component_names)
+    if official_sources is not None:
+        (mirror, base_mirror, selected_components, source_code) = read_official_sources(config, component_names)
+        (components, wanted_mirror, wanted_base_mirror, wanted_source_code) = official_sources
+        if (sorted(components), wanted_mirror, wanted_base_mirror, wanted_source_code) != (sorted(selected_components), mirror, base_mirror, source_code):
+            transaction.set_official_sources(*official_sources)
+
+    if transaction.is_empty():
+        print (_("The sources already match the manifest."))
+        return
+    for step in transaction.get_plan():
+        print (step)
+    if dry_run:
+        return
+
+    errors = transaction.commit(refresh=refresh_apt_cache)
+    for error in errors:
+        print (error)
+    if len(errors) > 0:
+        sys.exit(1)
+
+def rank_mirrors_via_cli(lsb_codename, is_base, as_json, apply):
+    (config, optional_components, system_keys) = get_platform_info().get_mintsources_config(lsb_codename)
+    if is_base:
+        mirrors = read_mirror_list(config["mirrors"]["base_mirrors"])
+    else:
+        mirrors = read_mirror_list(config["mirrors"]["mirrors"])
+
+    tester = MirrorTester(config, is_base)
+    visible_mirrors = sort_mirrors_by_location(mirrors, get_country_index(), get_local_country_code(), tester.default_mirror)
+
+    # Reuse fresh measurements, probe the others
+    speeds = {}
+    latencies = {}
+    stale_urls = []
+    for mirror in visible_mirrors:
+        entry = tester.mirror_cache.get(mirror.url, tester.codename)
+        if tester.mirror_cache.is_fresh(entry, "latency"):
+            latencies[mirror.url] = entry["latency"]
+            if tester.mirror_cache.is_fresh(entry, "speed"):
+                speeds[mirror.url] = entry["speed"]
+        else:
+            stale_urls.append(mirror.url)
+
+    workers = int(config["mirrors"].get("speed_test_workers", SPEED_TEST_WORKERS))
+    (new_latencies, new_speeds) = tester.probe(stale_urls, SpeedTestPool(max_workers=workers))
+    latencies.update(new_latencies)
+    speeds.update(new_speeds)
+    tester.mirror_cache.save()
+
+    # Mirrors with a measured throughput first, then by latency
+    def rank_key(mirror):
+        latency = latencies.get(mirror.url)
+        if latency is None or latency < 0:
+            latency = float("inf")
+        return (-speeds.get(mirror.url, 0), latency)
+    ranking = sorted(visible_mirrors, key=rank_key)
+
+    if as_json:
+        print(json.dumps([{"url": mirror.url, "name": mirror.name, "country": mirror.country_code, "speed": speeds.get(mirror.url, 0), "latency": latencies.get(mirror.url)} for mirror in ranking], indent=2))
+    else:
+        for (rank, mirror) in enumerate(ranking, 1):
+            speed = speeds.get(mirror.url, 0)
+            latency = latencies.get(mirror.url)
+            if speed == -1 or latency == -1:
+                label = _("Obsolete")
+            elif speed > 0:
+                label = get_speed_label(speed)
+            elif latency is not None:
+                label = _("%d ms") % (latency * 1000)
+            else:
+                label = _("Unreachable")
+            print("%3d  %-12s  %-2s  %s" % (rank, label, mirror.country_code, mirror.url))
+
+    if apply:
+        if len(ranking) == 0 or speeds.get(ranking[0].url, 0) <= 0:
+            print(_("No reachable mirror was found."))
+            sys.exit(1)
+        (mirror, base_mirror, selected_components, source_code) = read_official_sources(config, [name for (name, description) in optional_components])
+        if is_base:
+            base_mirror = ranking[0].url
+        else:
+            mirror = ranking[0].url
+        write_official_sources(lsb_codename, config, selected_components, mirror, base_mirror, source_code)
+        print(_("Switched to %s") % ranking[0].url)
+
 class CurlCallback:
     def __init__(self):
         self.contents = ''
@@ -249,6 +1514,14 @@ class PPAException(Exception):
 SPEED_PIX_WIDTH = 125
 SPEED_PIX_HEIGHT = 16
 
+# Number of mirrors tested at the same time, and per host
+SPEED_TEST_WORKERS = 8
+SPEED_TEST_WORKERS_PER_HOST = 1
+
+# The mirror list is filled this many rows per idle callback, and test results are written to it at this interval (ms)
+MIRROR_LIST_BATCH_SIZE = 50
+MIRROR_LIST_UPDATE_INTERVAL = 250
+
 class Component():
     def __init__(self, name, description, selected):
         self.name = name
@@ -264,6 +1537,8 @@ class Key():
         self.pub = pub
         self.sub = ""
         self.uid = ""
+        self.fingerprint = ""
+        self.keyring = ""
 
     def delete(self):
         os.system("apt-key del '%s'" % self.pub)
@@ -271,6 +1546,280 @@ class Key():
     def get_name(self):
         return "%s\n<small>    %s</small>" % (GObject.markup_escape_text(self.uid), GObject.markup_escape_text(self.pub))
 
+TRUSTED_KEYRING_PATH = "/etc/apt/trusted.gpg"
+TRUSTED_KEYRINGS_DIR = "/etc/apt/trusted.gpg.d"
+
+def list_keyrings():
+    keyrings = []
+    if os.path.exists(TRUSTED_KEYRING_PATH):
+        keyrings.append(TRUSTED_KEYRING_PATH)
+    if os.path.isdir(TRUSTED_KEYRINGS_DIR):
+        for file in sorted(os.listdir(TRUSTED_KEYRINGS_DIR)):
+            if file.endswith(".gpg") or file.endswith(".asc"):
+                keyrings.append(os.path.join(TRUSTED_KEYRINGS_DIR, file))
+    return keyrings
+
+def dearmor(data):
+    # The binary content of the ASCII armored blocks in data
+    binary = b""
+    body = None
+    for line in data.decode("ascii", "ignore").splitlines():
+        line = line.strip()
+        if line.startswith("-----BEGIN PGP"):
+            body = []
+        elif body is not None and (line.startswith("-----END PGP") or line.startswith("=")):
+            binary += base64.b64decode("".join(body))
+            body = None
+        elif body is not None and line != "" and ":" not in line:
+            body.append(line)
+    return binary
+
+def read_openpgp_packets(data):
+    # Yields (tag, body, start, end) for the OpenPGP packets in data (RFC 4880 section 4.2),
+    # start and end being the offsets of the whole packet, header included. Stops at the first malformed packet.
+    position = 0
+    while position < len(data):
+        start = position
+        header = data[position]
+        if not header & 0x80:
+            return
+        if header & 0x40:
+            tag = header & 0x3f
+            if position + 2 > len(data):
+                return
+            first = data[position + 1]
+            if first < 192:
+                (length, position) = (first, position + 2)
+            elif first < 224:
+                if position + 3 > len(data):
+                    return
+                (length, position) = (((first - 192) << 8) + data[position + 2] + 192, position + 3)
+            elif first == 255:
+                if position + 6 > len(data):
+                    return
+                (length, position) = (int.from_bytes(data[position + 2:position + 6], "big"), position + 6)
+            else:
+                # Partial lengths aren't used for keys
+                return
+        else:
+            tag = (header >> 2) & 0x0f
+            length_type = header & 0x03
+            if length_type == 3:
+                (length, position) = (len(data) - position - 1, position + 1)
+            else:
+                size = 1 << length_type
+                if position + 1 + size > len(data):
+                    return
+                (length, position) = (int.from_bytes(data[position + 1:position + 1 + size], "big"), position + 1 + size)
+        if position + length > len(data):
+            return
+        yield (tag, data[position:position + length], start, position + length)
+        position += length
+
+def get_key_fingerprint(body):
+    # Fingerprint of a public key packet body, or None for old v3 keys and malformed packets
+    if len(body) == 0:
+        return None
+    version = body[0]
+    if version == 4:
+        if len(body) > 0xffff:
+            return None
+        return hashlib.sha1(b"\x99" + len(body).to_bytes(2, "big") + body).hexdigest().upper()
+    elif version in (5, 6):
+        prefix = b"\x9a" if version == 5 else b"\x9b"
+        return hashlib.sha256(prefix + len(body).to_bytes(4, "big") + body).hexdigest().upper()
+    return None
+
+def read_keyring_data(data):
+    # Returns [(fingerprint, first user id)] for the primary keys of a binary or armored keyring
+    keys = []
+    if data.lstrip().startswith(b"-----BEGIN"):
+        data = dearmor(data)
+    fingerprint = None
+    uid = None
+    for (tag, body, start, end) in read_openpgp_packets(data):
+        if tag == 6:
+            if fingerprint is not None:
+                keys.append((fingerprint, uid or ""))
+            fingerprint = get_key_fingerprint(body)
+            uid = None
+        elif tag == 13 and uid is None:
+            uid = body.decode("utf-8", "replace")
+    if fingerprint is not None:
+        keys.append((fingerprint, uid or ""))
+    return keys
+
+def extract_key(data, key_id):
+    # Returns (fingerprint, binary key) for the one primary key of a binary or armored keyring
+    # whose fingerprint ends with key_id: its public key packet and everything up to the next one
+    # (user ids, signatures, subkeys). The other keys are left out. (None, None) if there isn't exactly one.
+    if data.lstrip().startswith(b"-----BEGIN"):
+        try:
+            data = dearmor(data)
+        except ValueError:
+            # Broken base64 (binascii.Error)
+            return (None, None)
+    matches = []
+    matching = False
+    parsed = 0
+    for (tag, body, start, end) in read_openpgp_packets(data):
+        if tag == 6:
+            fingerprint = get_key_fingerprint(body)
+            matching = (fingerprint is not None and fingerprint.endswith(key_id))
+            if matching:
+                matches.append([fingerprint, start, end])
+        elif matching:
+            matches[-1][2] = end
+        parsed = end
+    # The packets stop short of the end when the data is truncated or malformed
+    if parsed != len(data) or len(matches) != 1:
+        return (None, None)
+    (fingerprint, start, end) = matches[0]
+    return (fingerprint, data[start:end])
+
+def read_keyring(path):
+    try:
+        with open(path, "rb") as keyring_file:
+            return read_keyring_data(keyring_file.read())
+    except Exception as detail:
+        print ("Cannot read keyring %s: %s" % (path, detail))
+        return []
+
+class KeyIndex():
+    # The keys of the APT keyrings, by fingerprint. The keyrings are parsed
+    # directly, and only read again when their mtime or size changes.
+    def __init__(self):
+        self.keys = collections.OrderedDict()
+        self._keyrings = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        # Returns [(fingerprint, uid, keyring)]
+        with self._lock:
+            keyrings = list_keyrings()
+            for keyring in list(self._keyrings.keys()):
+                if keyring not in keyrings:
+                    del self._keyrings[keyring]
+            for keyring in keyrings:
+                stat = get_file_stat(keyring)
+                if keyring not in self._keyrings or self._keyrings[keyring][0] != stat:
+                    self._keyrings[keyring] = (stat, read_keyring(keyring))
+            self.keys = collections.OrderedDict()
+            for keyring in keyrings:
+                for (fingerprint, uid) in self._keyrings[keyring][1]:
+                    if fingerprint not in self.keys:
+                        self.keys[fingerprint] = (uid, keyring)
+            return [(fingerprint, uid, keyring) for (fingerprint, (uid, keyring)) in self.keys.items()]
+
+KEYSERVER_URL = "https://keyserver.ubuntu.com"
+KEY_CACHE_DIR = os.path.join(CACHE_DIR, "keys")
+KEY_FETCH_TIMEOUT = 10
+KEY_FETCH_RETRIES = 3
+
+class KeyException(Exception):
+
+    def __init__(self, value, original_error=None):
+        self.value = value
+        self.original_error = original_error
+
+    def __str__(self):
+        return str(self.value)
+
+class KeyFetcher():
+    # Downloads public keys from an HKP keyserver, all at once, and installs them in trusted.gpg.d.
+    # Only the requested key is kept from the keyserver's reply, anything else it contains isn't trusted.
+    # Downloaded keys are kept in a local cache, so installing them again needs no keyserver.
+    def __init__(self, keyserver=KEYSERVER_URL, cache_dir=KEY_CACHE_DIR, timeout=KEY_FETCH_TIMEOUT, retries=KEY_FETCH_RETRIES):
+        self.keyserver = keyserver.rstrip("/")
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retries = retries
+
+    def _normalize(self, key_id):
+        key_id = key_id.strip().replace(" ", "").upper()
+        if key_id.startswith("0X"):
+            key_id = key_id[2:]
+        if not re.match("^([0-9A-F]{8}|[0-9A-F]{16}|[0-9A-F]{40}|[0-9A-F]{64})$", key_id):
+            raise KeyException(_("Invalid key ID: '%s'.") % key_id)
+        return key_id
+
+    def _read_cache(self, key_id):
+        try:
+            files = os.listdir(self.cache_dir)
+        except OSError:
+            return None
+        for file in files:
+            if file.endswith(".gpg") and file[:-4].endswith(key_id):
+                with open(os.path.join(self.cache_dir, file), "rb") as key_file:
+                    return key_file.read()
+        return None
+
+    def _download(self, key_id):
+        url = "%s/pks/lookup?op=get&options=mr&search=0x%s" % (self.keyserver, key_id)
+        try:
+            response = get_http_client().get(url, timeout=self.timeout, retries=self.retries - 1)
+        except Exception as detail:
+            raise KeyException(_("Cannot download key %s: '%s'.") % (key_id, detail), detail)
+        if response.status_code == 404:
+            raise KeyException(_("Key %s not found on %s.") % (key_id, self.keyserver))
+        if response.status_code >= 400:
+            raise KeyException(_("Cannot download key %s: '%s'.") % (key_id, response.status_code))
+        return response.content
+
+    def fetch(self, key_id):
+        # Returns (fingerprint, binary key)
+        key_id = self._normalize(key_id)
+        data = self._read_cache(key_id)
+        if data is not None:
+            (fingerprint, key) = extract_key(data, key_id)
+            if fingerprint is not None:
+                return (fingerprint, key)
+        (fingerprint, key) = extract_key(self._download(key_id), key_id)
+        if fingerprint is None:
+            raise KeyException(_("The keyserver didn't return key %s, or returned several keys matching it.") % key_id)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_file_atomically(os.path.join(self.cache_dir, "%s.gpg" % fingerprint), key)
+        except (IOError, OSError) as detail:
+            print ("Error saving key cache: %s" % detail)
+        return (fingerprint, key)
+
+    def fetch_all(self, key_ids):
+        # Returns {key id: (fingerprint, binary key) or KeyException}
+        results = {}
+        def fetch(key_id):
+            try:
+                results[key_id] = self.fetch(key_id)
+            except KeyException as detail:
+                results[key_id] = detail
+            except Exception as detail:
+                # Whatever the keyserver sent, the key must not be silently left out
+                results[key_id] = KeyException(_("Cannot download key %s: '%s'.") % (key_id, detail), detail)
+        threads = [threading.Thread(target=fetch, args=(key_id,)) for key_id in set(key_ids)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def install(self, key_ids):
+        # Fetches the keys and adds them to trusted.gpg.d. Returns {key id: error message} for the failures.
+        errors = {}
+        results = self.fetch_all(key_ids)
+        for key_id in key_ids:
+            if key_id not in results:
+                errors[key_id] = _("Cannot download key %s.") % key_id
+        for (key_id, result) in results.items():
+            if isinstance(result, KeyException):
+                errors[key_id] = str(result)
+                continue
+            (fingerprint, key) = result
+            try:
+                write_file_atomically(os.path.join(TRUSTED_KEYRINGS_DIR, "mintsources-%s.gpg" % fingerprint), key)
+            except (IOError, OSError) as detail:
+                errors[key_id] = _("Cannot install key %s: '%s'.") % (fingerprint, detail)
+        return errors
+
 class Mirror():
     def __init__(self, country_code, url, name):
         self.country_code = country_code
@@ -278,102 +1827,132 @@ class Mirror():
         self.name = name
 
 class Repository():
-    def __init__(self, application, line, file, selected):
+    def __init__(self, application, line, source_file, line_number, selected):
         self.application = application
         self.line = line
-        self.file = file
+        self.source_file = source_file
+        self.line_number = line_number
+        self.file = source_file.path
         self.selected = selected
 
     def switch(self):
         self.selected = (not self.selected)
-
-        readfile = open(self.file, "r")
-        content = readfile.read()
-        readfile.close()
-
-        if self.selected:
-            content = content.replace("#%s" % self.line, self.line)
-            content = content.replace("# %s" % self.line, self.line)
-        else:
-            content = content.replace(self.line, "# %s" % self.line)
-
-        with open(self.file, "w") as writefile:
-            writefile.write(content)
-
-        self.application.enable_reload_button()
+        self.source_file.set_entry_enabled(self.line_number, self.line, self.selected)
+        self.application.sources_changed()
 
     def edit(self, newline):
-        readfile = open(self.file, "r")
-        content = readfile.read()
-        readfile.close()
-        content = content.replace(self.line, newline)
-        with open(self.file, "w") as writefile:
-            writefile.write(content)
-        self.line = newline
-        self.application.enable_reload_button()
+        self.line = self.source_file.edit_entry(self.line_number, self.line, newline)
+        self.application.sources_changed()
 
     def delete(self):
-        readfile = open(self.file, "r")
-        content = readfile.read()
-        readfile.close()
-        content = content.replace(self.line, "")
-        with open(self.file, "w") as writefile:
-            writefile.write(content)
-
-        # If the file no longer contains any "deb" instances, delete it as well
-        if "deb" not in content:
-            os.unlink(self.file)
-
-        self.application.enable_reload_button()
+        self.source_file.delete_line(self.line_number)
+        self.application.sources_changed()
+
+    @property
+    def deb(self):
+        return parse_deb_line(self.line)
+
+    def get_ppa_info(self):
+        # Returns (owner, name) for Launchpad PPAs, None otherwise
+        deb = self.deb
+        if deb is not None and deb.uri.startswith("http://ppa.launchpad.net/"):
+            path = deb.uri[len("http://ppa.launchpad.net/"):].rstrip("/")
+            if path.endswith("/ubuntu") and path.count("/") == 2:
+                (owner, name, distro) = path.split("/")
+                return (owner, name)
+        return None
 
     def get_ppa_name(self):
-        elements = self.line.split(" ")
-        name = elements[1].replace("deb-src ", "")
-        name = name.replace("deb ", "")
-        name = name.replace("http://ppa.launchpad.net/", "")
-        name = name.replace("/ubuntu", "")
-        name = name.replace("/ppa", "")
-        if self.line.startswith("deb-src"):
+        deb = self.deb
+        name = self.line
+        if deb is not None:
+            name = deb.uri.replace("http://ppa.launchpad.net/", "")
+            name = name.replace("/ubuntu", "")
+            name = name.replace("/ppa", "")
+        if deb is not None and deb.type == "deb-src":
             suffix = _("Sources")
             name = "%s (%s)" % (name, suffix)
         return "<b>%s</b>\n<small><i>%s</i></small>\n<small><i>%s</i></small>" % (name, self.line, self.file)
 
     def get_repository_name(self):
-        line = self.line.strip()
-        name = line
-        if line.startswith("deb cdrom:"):
+        deb = self.deb
+        name = self.line.strip()
+        if deb is None:
+            return "<b>%s</b>\n<small><i>%s</i></small>\n<small><i>%s</i></small>" % (name, self.line, self.file)
+        if deb.uri.startswith("cdrom:"):
             name = _("CD-ROM (Installation Disc)")
         else:
             try:
-                elements = self.line.split(" ")
-                for element in elements:
-                   for protocol in ['http://', 'ftp://', 'https://']:
-                        if element.startswith(protocol):
-                            name = element.replace(protocol, "").split("/")[0]
-                            subparts = name.split(".")
-                            if len(subparts) > 2:
-                                if subparts[-2] != "co":
-                                    name = subparts[-2].capitalize()
-                                else:
-                                    name = subparts[-3].capitalize()
-                            break
+                if deb.uri.split("://")[0] in ['http', 'ftp', 'https']:
+                    name = deb.uri.split("://", 1)[1].split("/")[0]
+                    subparts = name.split(".")
+                    if len(subparts) > 2:
+                        if subparts[-2] != "co":
+                            name = subparts[-2].capitalize()
+                        else:
+                            name = subparts[-3].capitalize()
                 name = name.replace("Linuxmint", "Linux Mint")
                 name = name.replace("01", "Intel")
                 name = name.replace("Steampowered", "Steam")
             except:
                 pass
-            if self.line.startswith("deb-src"):
+            if deb.type == "deb-src":
                 name = "%s (%s)" % (name, _("Sources"))
         return "<b>%s</b>\n<small><i>%s</i></small>\n<small><i>%s</i></small>" % (name, self.line, self.file)
 
-class ComponentToggleCheckBox(Gtk.CheckButton):
+class FlagCache():
+    # Process-wide cache of flag pixbufs, keyed by file and size
+    def __init__(self):
+        self._pixbufs = {}
+        self._exists = {}
+        self._lock = threading.Lock()
+
+    def exists(self, path):
+        if path not in self._exists:
+            self._exists[path] = os.path.exists(path)
+        return self._exists[path]
+
+    def get_path(self, country_code):
+        if country_code == "WD":
+            path = FLAG_PATH % '_united_nations'
+        else:
+            path = FLAG_PATH % country_code.lower()
+        if not self.exists(path):
+            path = FLAG_PATH % '_generic'
+        return path
+
+    def get_pixbuf(self, path, size=FLAG_SIZE):
+        key = (path, size)
+        with self._lock:
+            pixbuf = self._pixbufs.get(key)
+        if pixbuf is None:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(path, -1, size)
+            with self._lock:
+                pixbuf = self._pixbufs.setdefault(key, pixbuf)
+        return pixbuf
+
+    def get(self, country_code, size=FLAG_SIZE):
+        return self.get_pixbuf(self.get_path(country_code), size)
+
+    @_async
+    def preload(self, country_codes, size=FLAG_SIZE):
+        for country_code in ["WD"] + sorted(country_codes):
+            try:
+                self.get(country_code, size)
+            except Exception as detail:
+                print (detail)
+
+flag_cache = FlagCache()
+
+class ComponentToggleCheckBox():
+    # Holds its check button rather than being one, so that Gtk isn't needed to define it
     def __init__(self, application, component, window):
         self.application = application
         self.component = component
         self.window_object = window
-        Gtk.CheckButton.__init__(self, self.component.description)
-        self.set_active(component.selected)
-        self.connect("toggled", self._on_toggled)
+        self.widget = Gtk.CheckButton(label=self.component.description)
+        self.widget.set_active(component.selected)
+        self.widget.connect("toggled", self._on_toggled)
 
     def _on_toggled(self, widget):
         # As long as the interface isn't fully loaded, don't do anything
@@ -394,6 +1973,677 @@ class ComponentToggleCheckBox(Gtk.CheckButton):
             self.component.selected = widget.get_active()
             self.application.apply_official_sources()
 
+class ThroughputMeter():
+    # pycurl write callback which discards the body and samples the transfer,
+    # aborting it once the byte budget or the time window is used up
+    def __init__(self, max_bytes=None, max_seconds=None):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.nb_bytes = 0
+        self.samples = [] # (time, total bytes received)
+        self.done = False
+
+    def write(self, buf):
+        now = time.time()
+        self.nb_bytes += len(buf)
+        self.samples.append((now, self.nb_bytes))
+        if self.max_bytes is not None and self.nb_bytes >= self.max_bytes:
+            self.done = True
+        elif self.max_seconds is not None and (now - self.samples[0][0]) >= self.max_seconds:
+            self.done = True
+        if self.done:
+            return 0 # abort the transfer
+        return None
+
+    def get_speed(self):
+        # Bytes/sec between the first and the last sample, the first chunk only marks the start
+        if len(self.samples) < 2:
+            return None
+        (start_time, start_bytes) = self.samples[0]
+        (end_time, end_bytes) = self.samples[-1]
+        if end_time <= start_time:
+            return None
+        return (end_bytes - start_bytes) / (end_time - start_time)
+
+class SpeedTestPool():
+    # Runs jobs on a bounded number of worker threads, never running more than
+    # max_per_host jobs against the same host at once.
+    def __init__(self, max_workers=SPEED_TEST_WORKERS, max_per_host=SPEED_TEST_WORKERS_PER_HOST):
+        self.max_workers = max(1, max_workers)
+        self.max_per_host = max(1, max_per_host)
+        self._condition = threading.Condition()
+        self._jobs = []
+        self._busy_hosts = {}
+        self._cancelled = False
+
+    def run(self, jobs):
+        # jobs is a list of (url, function, args), blocks until all jobs are done
+        with self._condition:
+            self._jobs = [(urlparse(url).hostname, function, args) for (url, function, args) in jobs]
+            self._busy_hosts = {}
+        threads = []
+        for i in range(min(self.max_workers, len(jobs))):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+    def cancel(self):
+        with self._condition:
+            self._cancelled = True
+            self._jobs = []
+            self._condition.notify_all()
+
+    def _next_job(self):
+        with self._condition:
+            while self._jobs and not self._cancelled:
+                for i, job in enumerate(self._jobs):
+                    host = job[0]
+                    if self._busy_hosts.get(host, 0) < self.max_per_host:
+                        del self._jobs[i]
+                        self._busy_hosts[host] = self._busy_hosts.get(host, 0) + 1
+                        return job
+                # Every remaining job targets a busy host, wait for one to finish
+                self._condition.wait()
+            return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            (host, function, args) = job
+            try:
+                function(*args)
+            except Exception as detail:
+                print ("Error '%s' on host %s" % (detail, host))
+            finally:
+                with self._condition:
+                    self._busy_hosts[host] = self._busy_hosts.get(host, 1) - 1
+                    self._condition.notify_all()
+
+# Only the mirrors which answer the fastest get a throughput test, capped in size
+THROUGHPUT_TEST_CANDIDATES = 10
+THROUGHPUT_TEST_BYTES = 1024 * 1024
+THROUGHPUT_TEST_SECONDS = 5
+
+# Number of db/version requests in flight at the same time
+FRESHNESS_CHECK_CONNECTIONS = 16
+
+# Mirror measurements older than this are refreshed in the background
+MIRROR_CACHE_PATH = os.path.join(CACHE_DIR, "mirrors.json")
+MIRROR_CACHE_TTL = 24 * 3600
+MIRROR_CACHE_MAX_ENTRIES = 2000
+# Failed measurements (unreachable, obsolete) are retried much sooner, a network hiccup shouldn't last a day
+MIRROR_CACHE_FAILURE_TTL = 5 * 60
+
+class MeasurementCache():
+    # Persistent cache of values measured or fetched per URL and codename (e.g. the speed of a mirror),
+    # each with the time it was checked, and least recently used eviction beyond max_entries.
+    # Values put as failed stay fresh for failure_ttl only. Without a path, it's only kept in memory.
+    def __init__(self, path, ttl, max_entries, failure_ttl=None):
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = ttl if failure_ttl is None else failure_ttl
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.load()
+
+    def _key(self, url, codename):
+        return "%s %s" % (url.rstrip("/"), codename)
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as cache_file:
+                data = json.load(cache_file)
+            with self._lock:
+                self._entries = collections.OrderedDict((key, entry) for (key, entry) in data["entries"])
+        except Exception:
+            self._entries = collections.OrderedDict()
+
+    def save(self):
+        # Under the lock, since threads share the temporary file
+        with self._lock:
+            if not self._dirty or self.path is None:
+                return
+            data = {"entries": list(self._entries.items())}
+            self._dirty = False
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = "%s.tmp" % self.path
+                with open(tmp_path, "w") as cache_file:
+                    json.dump(data, cache_file)
+                os.rename(tmp_path, self.path)
+            except Exception as detail:
+                print ("Error saving cache %s: %s" % (self.path, detail))
+
+    def get(self, url, codename):
+        key = self._key(url, codename)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return dict(entry)
+            return None
+
+    def is_fresh(self, entry, field):
+        # Each measurement has its own check time, e.g. speed_checked, and failure flag, e.g. speed_failed
+        if entry is None or field not in entry:
+            return False
+        ttl = self.failure_ttl if entry.get("%s_failed" % field) else self.ttl
+        return (time.time() - entry.get("%s_checked" % field, 0)) < ttl
+
+    def put(self, url, codename, failed=False, **values):
+        key = self._key(url, codename)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, {})
+            for field, value in values.items():
+                entry[field] = value
+                entry["%s_checked" % field] = now
+                if failed:
+                    entry["%s_failed" % field] = True
+                else:
+                    entry.pop("%s_failed" % field, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+COUNTRIES_PATH = "/usr/lib/linuxmint/mintSources/countries.json"
+
+def read_mirror_list(path):
+    mirror_list = []
+    country_code = None
+    mirrorsfile = open(path, "r")
+    for line in mirrorsfile.readlines():
+        line = line.strip()
+        if line != "":
+            if ("#LOC:" in line):
+                country_code = line.split(":")[1]
+            else:
+                if country_code is not None:
+                    if ("ubuntu-ports" not in line):
+                        elements = line.split(" ")
+                        url = elements[0]
+                        if len(elements) > 1:
+                            name = " ".join(elements[1:])
+                        else:
+                            name = url
+                        if url[-1] == "/":
+                            url = url[:-1]
+                        mirror = Mirror(country_code, url, name)
+                        mirror_list.append(mirror)
+    mirrorsfile.close()
+    return mirror_list
+
+COUNTRY_INDEX_PATH = os.path.join(CACHE_DIR, "countries-index.json")
+
+def load_countries():
+    with open(COUNTRIES_PATH) as data_file:
+        return json.load(data_file)
+
+class CountryIndex():
+    # Compact lookup tables derived from countries.json, all keyed by cca2 code
+    def __init__(self, countries=None):
+        self.countries = {} # cca2 -> {"cca3", "region", "subregion"}
+        self.cca3_to_cca2 = {}
+        self.regions = {} # region -> set of cca2
+        self.subregions = {} # "region/subregion" -> set of cca2
+        self.borders = {} # cca2 -> set of cca2
+        if countries is not None:
+            self._build(countries)
+
+    def _build(self, countries):
+        for country in countries:
+            self.countries[country["cca2"]] = {"cca3": country["cca3"], "region": country["region"], "subregion": country["subregion"]}
+            self.cca3_to_cca2[country["cca3"]] = country["cca2"]
+        for country in countries:
+            country_code = country["cca2"]
+            self.regions.setdefault(country["region"], set()).add(country_code)
+            self.subregions.setdefault(self._subregion_key(country), set()).add(country_code)
+            self.borders[country_code] = set(self.cca3_to_cca2[cca3] for cca3 in country["borders"] if cca3 in self.cca3_to_cca2)
+
+    def _subregion_key(self, country):
+        return "%s/%s" % (country["region"], country["subregion"])
+
+    def get_country(self, country_code):
+        return self.countries.get(country_code)
+
+    def get_region(self, country_code):
+        country = self.countries.get(country_code)
+        if country is None:
+            return set()
+        return self.regions[country["region"]]
+
+    def get_subregion(self, country_code):
+        country = self.countries.get(country_code)
+        if country is None:
+            return set()
+        return self.subregions[self._subregion_key(country)]
+
+    def get_borders(self, country_code):
+        return self.borders.get(country_code, set())
+
+    def to_json(self):
+        return {"countries": self.countries,
+                "regions": dict((key, sorted(codes)) for (key, codes) in self.regions.items()),
+                "subregions": dict((key, sorted(codes)) for (key, codes) in self.subregions.items()),
+                "borders": dict((key, sorted(codes)) for (key, codes) in self.borders.items())}
+
+    @classmethod
+    def from_json(cls, data):
+        index = cls()
+        index.countries = data["countries"]
+        index.cca3_to_cca2 = dict((country["cca3"], country_code) for (country_code, country) in index.countries.items())
+        index.regions = dict((key, set(codes)) for (key, codes) in data["regions"].items())
+        index.subregions = dict((key, set(codes)) for (key, codes) in data["subregions"].items())
+        index.borders = dict((key, set(codes)) for (key, codes) in data["borders"].items())
+        return index
+
+_country_index = None
+_country_index_lock = threading.Lock()
+
+def get_country_index():
+    # Built once per process, and serialized until countries.json changes
+    global _country_index
+    with _country_index_lock:
+        if _country_index is None:
+            source_mtime = os.path.getmtime(COUNTRIES_PATH)
+            try:
+                with open(COUNTRY_INDEX_PATH) as index_file:
+                    data = json.load(index_file)
+                if data["source_mtime"] == source_mtime:
+                    _country_index = CountryIndex.from_json(data)
+            except Exception:
+                pass
+            if _country_index is None:
+                _country_index = CountryIndex(load_countries())
+                try:
+                    os.makedirs(os.path.dirname(COUNTRY_INDEX_PATH), exist_ok=True)
+                    data = _country_index.to_json()
+                    data["source_mtime"] = source_mtime
+                    with open(COUNTRY_INDEX_PATH, "w") as index_file:
+                        json.dump(data, index_file)
+                except Exception as detail:
+                    print ("Error saving country index: %s" % detail)
+        return _country_index
+
+GEOIP_URL = 'http://geoip.ubuntu.com/lookup'
+GEOIP_TIMEOUT = 3
+GEOIP_CACHE_PATH = os.path.join(CACHE_DIR, "geoip.json")
+GEOIP_CACHE_TTL = 7 * 24 * 3600
+
+def get_offline_country_code():
+    # Guess where we're located from the timezone, then from LANG
+    timezone = None
+    try:
+        with open("/etc/timezone") as timezone_file:
+            timezone = timezone_file.read().strip()
+    except Exception:
+        localtime = os.path.realpath("/etc/localtime")
+        if "/zoneinfo/" in localtime:
+            timezone = localtime.split("/zoneinfo/", 1)[1]
+    if timezone:
+        try:
+            with open("/usr/share/zoneinfo/zone.tab") as zone_file:
+                for line in zone_file:
+                    elements = line.split("\t")
+                    if not line.startswith("#") and len(elements) > 2 and elements[2].strip() == timezone:
+                        return elements[0]
+        except Exception as detail:
+            print (detail)
+
+    lang = os.environ.get('LANG', '').split('.')[0]
+    if "_" in lang:
+        return lang.split('_')[-1]
+    return 'US'
+
+def read_cached_country_code():
+    # Returns the last GeoIP answer, as long as it's recent enough
+    try:
+        with open(GEOIP_CACHE_PATH) as cache_file:
+            data = json.load(cache_file)
+        if (time.time() - data["checked"]) < GEOIP_CACHE_TTL:
+            return data["country_code"]
+    except Exception:
+        pass
+    return None
+
+def lookup_country_code(timeout=GEOIP_TIMEOUT):
+    # Try to find out where we're located...
+    try:
+        lookup = get_http_client().get(GEOIP_URL, timeout=timeout, retries=0).text
+        cur_country_code = re.search('<CountryCode>(.*)</CountryCode>', lookup).group(1)
+        if cur_country_code == 'None': cur_country_code = None
+    except Exception as detail:
+        cur_country_code = None  # no internet connection
+
+    if cur_country_code is not None:
+        try:
+            os.makedirs(os.path.dirname(GEOIP_CACHE_PATH), exist_ok=True)
+            with open(GEOIP_CACHE_PATH, "w") as cache_file:
+                json.dump({"country_code": cur_country_code, "checked": time.time()}, cache_file)
+        except Exception as detail:
+            print ("Error saving GeoIP cache: %s" % detail)
+    return cur_country_code
+
+def get_local_country_code(timeout=GEOIP_TIMEOUT):
+    return read_cached_country_code() or lookup_country_code(timeout) or get_offline_country_code()
+
+def sort_mirrors_by_location(mirrors, country_index, local_country_code, default_mirror):
+    # Returns the mirrors worth testing, closest ones first
+    bordering_countries = country_index.get_borders(local_country_code)
+    subregion = country_index.get_subregion(local_country_code)
+    region = country_index.get_region(local_country_code) - subregion
+
+    worldwide_mirrors = []
+    local_mirrors = []
+    bordering_mirrors = []
+    subregional_mirrors = []
+    regional_mirrors = []
+    official_mirrors = []
+    other_mirrors = []
+
+    for mirror in mirrors:
+        if mirror.country_code == "WD":
+            worldwide_mirrors.append(mirror)
+        elif mirror.country_code == local_country_code:
+            local_mirrors.append(mirror)
+        elif mirror.country_code in bordering_countries:
+            bordering_mirrors.append(mirror)
+        elif mirror.country_code in subregion:
+            subregional_mirrors.append(mirror)
+        elif mirror.country_code in region:
+            regional_mirrors.append(mirror)
+        elif mirror.url == default_mirror:
+            official_mirrors.append(mirror)
+        else:
+            other_mirrors.append(mirror)
+
+    worldwide_mirrors = sorted(worldwide_mirrors, key=lambda x: x.country_code)
+    bordering_mirrors = sorted(bordering_mirrors, key=lambda x: x.country_code)
+    subregional_mirrors = sorted(subregional_mirrors, key=lambda x: x.country_code)
+    regional_mirrors = sorted(regional_mirrors, key=lambda x: x.country_code)
+
+    visible_mirrors = worldwide_mirrors + local_mirrors + bordering_mirrors + subregional_mirrors + regional_mirrors + official_mirrors
+
+    if local_country_code in ["IL"]:
+        # For some countries, geographical proximity doesn't equate to faster mirrors.
+        visible_mirrors = visible_mirrors + other_mirrors
+
+    if len(visible_mirrors) < 2:
+        # We failed to identify the continent/country, let's show all mirrors
+        visible_mirrors = mirrors
+
+    return visible_mirrors
+
+def get_speed_label(speed):
+    if speed > 0:
+        divider = (1024 * 1.0)
+        represented_speed = (speed / divider)   # translate it to kB/S
+        unit = _("kB/s")
+        if represented_speed > divider:
+            represented_speed = (represented_speed / divider)   # translate it to MB/S
+            unit = _("MB/s")
+        if represented_speed > divider:
+            represented_speed = (represented_speed / divider)   # translate it to GB/S
+            unit = _("GB/s")
+        num_int_digits = len("%d" % represented_speed)
+        if (num_int_digits > 2):
+            represented_speed = "%d %s" % (represented_speed, unit)
+        else:
+            represented_speed = "%.1f %s" % (represented_speed, unit)
+        represented_speed = represented_speed.replace(".0", "")
+    else:
+        represented_speed = ("0 %s") % _("kB/s")
+    return represented_speed
+
+def update_model_rows(model, iters, results):
+    # Writes {url: {column: value}} to a sorted model. The sort is suspended meanwhile,
+    # so the model is re-sorted once per batch rather than on every value.
+    (sort_column, sort_order) = model.get_sort_column_id()
+    model.set_sort_column_id(Gtk.TREE_SORTABLE_UNSORTED_SORT_COLUMN_ID, Gtk.SortType.ASCENDING)
+    for (url, values) in results.items():
+        iter = iters.get(url)
+        if iter is not None:
+            model.set(iter, values)
+    if sort_column is not None:
+        model.set_sort_column_id(sort_column, sort_order)
+
+class FreshnessIndex():
+    # Last modification time of each mirror's db/version, fetched concurrently
+    # with a pool of curl handles which are reused, along with their connections.
+    def __init__(self, mirror_cache, codename, max_connections=FRESHNESS_CHECK_CONNECTIONS, on_transfer=None):
+        self.mirror_cache = mirror_cache
+        self.codename = codename
+        self.max_connections = max_connections
+        self.on_transfer = on_transfer
+        self.timestamps = {}
+        self._handles = []
+        self._multi = None
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        return url in self.timestamps
+
+    def get(self, url):
+        if url not in self.timestamps:
+            self.update([url])
+        return self.timestamps.get(url)
+
+    def _get_handle(self):
+        if len(self._handles) > 0:
+            return self._handles.pop()
+        c = get_http_client().get_curl(timeout=30)
+        c.setopt(pycurl.NOBODY, 1)
+        c.setopt(pycurl.OPT_FILETIME, 1)
+        return c
+
+    def _done(self, c, timestamp):
+        self._multi.remove_handle(c)
+        get_http_client().record(c.mirror_url, c.getinfo(pycurl.TOTAL_TIME), error=(timestamp is None))
+        if self.on_transfer is not None:
+            self.on_transfer(c)
+        self.timestamps[c.mirror_url] = timestamp
+        self.mirror_cache.put(c.mirror_url, self.codename, failed=(timestamp is None), timestamp=timestamp)
+        self._handles.append(c)
+
+    def update(self, urls):
+        with self._lock:
+            # Use the cached timestamps which are still fresh
+            pending = []
+            for url in urls:
+                if url in self.timestamps or url in pending:
+                    continue
+                entry = self.mirror_cache.get(url, self.codename)
+                if self.mirror_cache.is_fresh(entry, "timestamp"):
+                    self.timestamps[url] = entry["timestamp"]
+                else:
+                    pending.append(url)
+
+            if len(pending) == 0:
+                return
+            if self._multi is None:
+                self._multi = pycurl.CurlMulti()
+
+            nb_active = 0
+            while len(pending) > 0 or nb_active > 0:
+                while len(pending) > 0 and nb_active < self.max_connections:
+                    url = pending.pop(0)
+                    c = self._get_handle()
+                    c.mirror_url = url
+                    c.setopt(pycurl.URL, "%s/db/version" % url)
+                    self._multi.add_handle(c)
+                    nb_active += 1
+                while True:
+                    ret, nb_handles = self._multi.perform()
+                    if ret != pycurl.E_CALL_MULTI_PERFORM:
+                        break
+                while True:
+                    nb_queued, ok_list, error_list = self._multi.info_read()
+                    for c in ok_list:
+                        filetime = c.getinfo(pycurl.INFO_FILETIME)
+                        self._done(c, filetime if filetime >= 0 else None)
+                        nb_active -= 1
+                    for (c, errno, errmsg) in error_list:
+                        self._done(c, None)
+                        nb_active -= 1
+                    if nb_queued == 0:
+                        break
+                if nb_active > 0:
+                    self._multi.select(1.0)
+
+class MirrorTester():
+    # Measures mirrors for a given archive (main or base), without any UI
+    def __init__(self, config, is_base, mirror_cache=None):
+        self.config = config
+        self.is_base = is_base
+        if self.is_base:
+            self.codename = self.config["general"]["base_codename"]
+            self.default_mirror = self.config["mirrors"]["base_default"]
+        else:
+            self.codename = self.config["general"]["codename"]
+            self.default_mirror = self.config["mirrors"]["default"]
+        if mirror_cache is None:
+            mirror_cache = MeasurementCache(MIRROR_CACHE_PATH, MIRROR_CACHE_TTL, MIRROR_CACHE_MAX_ENTRIES, MIRROR_CACHE_FAILURE_TTL)
+        self.mirror_cache = mirror_cache
+        self.default_mirror_age = None
+        self.default_mirror_date = None
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+        self.freshness = FreshnessIndex(self.mirror_cache, self.codename, on_transfer=self._count_bytes)
+
+    def _count_bytes(self, c):
+        with self._lock:
+            self.bytes_downloaded += int(c.getinfo(pycurl.SIZE_DOWNLOAD) + c.getinfo(pycurl.HEADER_SIZE))
+
+    def find_default_mirror_age(self):
+        # Try to find the age of the Mint archive
+        self.default_mirror_age = None
+        self.default_mirror_date = None
+        mirror_timestamp = self.get_mirror_timestamp(self.default_mirror)
+        if mirror_timestamp is not None:
+            self.default_mirror_date = datetime.datetime.fromtimestamp(mirror_timestamp)
+            now = datetime.datetime.now()
+            self.default_mirror_age = (now - self.default_mirror_date).days
+
+    def get_mirror_timestamp(self, url):
+        return self.freshness.get(url)
+
+    def check_mirror_up_to_date(self, url):
+        if (self.default_mirror_age is None or self.default_mirror_age < 2):
+            # If the default server was updated recently, the age is irrelevant (it would measure the time between now and the last update)
+            return True
+        mirror_timestamp = self.get_mirror_timestamp(url)
+        if mirror_timestamp is None:
+            print ("Error: Can't find the age of %s !!" % url)
+            return False
+        mirror_date = datetime.datetime.fromtimestamp(mirror_timestamp)
+        mirror_age = (self.default_mirror_date - mirror_date).days
+        if (mirror_age > 2):
+            print ("Error: %s is out of date by %d days!" % (url, mirror_age))
+            return False
+        else:
+            # Age is fine :)
+            return True
+
+    def get_test_url(self, url):
+        if self.is_base:
+            return "%s/dists/%s/main/binary-amd64/Packages.gz" % (url, self.codename)
+        else:
+            return "%s/dists/%s/main/Contents-amd64.gz" % (url, self.codename)
+
+    def latency_test(self, url):
+        # Returns the time to first byte in seconds, -1 if the mirror is obsolete, None if it's unreachable
+        latency = None
+        try:
+            if (self.is_base or self.check_mirror_up_to_date(url)):
+                http_client = get_http_client()
+                c = http_client.get_curl(timeout=10)
+                try:
+                    c.setopt(pycurl.NOBODY, 1)
+                    http_client.perform(c, self.get_test_url(url))
+                    self._count_bytes(c)
+                    if c.getinfo(pycurl.RESPONSE_CODE) < 400:
+                        latency = max(c.getinfo(pycurl.STARTTRANSFER_TIME), c.getinfo(pycurl.CONNECT_TIME))
+                finally:
+                    http_client.release_curl(c)
+            else:
+                # the mirror is not up to date
+                latency = -1
+        except Exception as error:
+            print ("Error '%s' on url %s" % (error, url))
+            latency = None
+
+        # Unreachable (None) and obsolete (-1) mirrors are tested again soon
+        self.mirror_cache.put(url, self.codename, failed=(latency is None or latency < 0), latency=latency)
+        return latency
+
+    def speed_test(self, url, max_bytes=None, max_seconds=None):
+        download_speed = 0
+        try:
+            test_url = self.get_test_url(url)
+            if (self.is_base or self.check_mirror_up_to_date(url)):
+                http_client = get_http_client()
+                c = http_client.get_curl(timeout=20)
+                try:
+                    meter = ThroughputMeter(max_bytes, max_seconds)
+                    c.setopt(pycurl.WRITEFUNCTION, meter.write)
+                    if max_bytes is not None:
+                        c.setopt(pycurl.RANGE, "0-%d" % (max_bytes - 1))
+                    try:
+                        http_client.perform(c, test_url)
+                    except pycurl.error:
+                        # Aborting from the write callback is how the measurement ends
+                        if not meter.done:
+                            raise
+                    self._count_bytes(c)
+                    download_speed = meter.get_speed()
+                    if download_speed is None:
+                        download_speed = c.getinfo(pycurl.SPEED_DOWNLOAD) # bytes/sec
+                finally:
+                    http_client.release_curl(c)
+            else:
+                # the mirror is not up to date
+                download_speed = -1
+        except Exception as error:
+            print ("Error '%s' on url %s" % (error, url))
+            download_speed = 0
+
+        self.mirror_cache.put(url, self.codename, failed=(download_speed <= 0), speed=download_speed, reachable=(download_speed != 0))
+        return download_speed
+
+    def probe(self, urls, pool, candidates=THROUGHPUT_TEST_CANDIDATES, on_latency=None, on_speed=None):
+        # Check how up to date every mirror is before any measurement
+        if not self.is_base:
+            self.freshness.update([self.default_mirror] + urls)
+            self.find_default_mirror_age()
+
+        # Phase one: a cheap latency probe on every mirror
+        latencies = {}
+        def latency_job(url):
+            latencies[url] = self.latency_test(url)
+            if on_latency is not None:
+                on_latency(url, latencies[url])
+        pool.run([(url, latency_job, (url,)) for url in urls])
+
+        # Phase two: a throughput test, capped in size, on the mirrors which answered the fastest
+        responsive = sorted([url for url in urls if latencies.get(url) is not None and latencies[url] >= 0], key=lambda url: latencies[url])
+        speeds = {}
+        def speed_job(url):
+            speeds[url] = self.speed_test(url, max_bytes=THROUGHPUT_TEST_BYTES, max_seconds=THROUGHPUT_TEST_SECONDS)
+            if on_speed is not None:
+                on_speed(url, speeds[url])
+        pool.run([(url, speed_job, (url,)) for url in responsive[:candidates]])
+        return (latencies, speeds)
+
 class MirrorSelectionDialog(object):
     MIRROR_COLUMN = 0
     MIRROR_URL_COLUMN = 1
@@ -441,242 +2691,142 @@ class MirrorSelectionDialog(object):
 
         self.country_info = CountryInformation()
 
-        with open('/usr/lib/linuxmint/mintSources/countries.json') as data_file:
-            self.countries = json.load(data_file)
+        self.speed_test_pool = None
+        self.mirror_cache = MeasurementCache(MIRROR_CACHE_PATH, MIRROR_CACHE_TTL, MIRROR_CACHE_MAX_ENTRIES, MIRROR_CACHE_FAILURE_TTL)
+        self._generation = 0
+        self._pending_results = {}
+        self._pending_results_lock = threading.Lock()
 
     def _row_activated(self, treeview, path, view_column):
         self._dialog.response(Gtk.ResponseType.APPLY)
 
-    def get_country(self, country_code):
-        for country in self.countries:
-            if country["cca2"] == country_code:
-                return country
-        return None
-
     def _update_list(self):
+        # Results of previous runs are ignored once the list is rebuilt
+        self._generation += 1
+        if self.speed_test_pool is not None:
+            self.speed_test_pool.cancel()
+        with self._pending_results_lock:
+            self._pending_results = {}
         self._mirrors_model.clear()
+        self._iters = {}
+
+        rows = []
+        stale_urls = []
         for mirror in self.visible_mirrors:
             if mirror.country_code == "WD":
-                flag = FLAG_PATH % '_united_nations'
                 country_name = _("Worldwide")
             else:
-                flag = FLAG_PATH % mirror.country_code.lower()
                 country_name = self.country_info.get_country_name(mirror.country_code)
-            if not os.path.exists(flag):
-                flag = FLAG_PATH % '_generic'
             tooltip = country_name
             if mirror.name != mirror.url:
                 tooltip = "%s: %s" % (country_name, mirror.name)
-            self._mirrors_model.append((
-                mirror,
-                mirror.url,
-                GdkPixbuf.Pixbuf.new_from_file_at_size(flag, -1, FLAG_SIZE),
-                0,
-                None,
-                tooltip,
-                mirror.name
-            ))
-
-        self._all_speed_tests()
-
-    def get_url_last_modified(self, url):
-        try:
-            c = pycurl.Curl()
-            c.setopt(pycurl.URL, url)
-            c.setopt(pycurl.CONNECTTIMEOUT, 5)
-            c.setopt(pycurl.TIMEOUT, 30)
-            c.setopt(pycurl.FOLLOWLOCATION, 1)
-            c.setopt(pycurl.NOBODY, 1)
-            c.setopt(pycurl.OPT_FILETIME, 1)
-            c.perform()
-            filetime = c.getinfo(pycurl.INFO_FILETIME)
-            if filetime < 0:
-                return None
-            else:
-                return filetime
-        except:
-            return None
-
-    def check_mirror_up_to_date(self, url):
-        if (self.default_mirror_age is None or self.default_mirror_age < 2):
-            # If the default server was updated recently, the age is irrelevant (it would measure the time between now and the last update)
-            return True
-        mirror_timestamp = self.get_url_last_modified(url)
-        if mirror_timestamp is None:
-            print ("Error: Can't find the age of %s !!" % url)
+            row = [mirror, mirror.url, flag_cache.get(mirror.country_code), 0, None, tooltip, mirror.name]
+            # Paint the last known results right away, only re-test stale entries
+            entry = self.mirror_cache.get(mirror.url, self.codename)
+            values = {}
+            if entry is not None and "speed" in entry:
+                values = self._get_speed_values(entry["speed"])
+            elif entry is not None and "latency" in entry:
+                values = self._get_latency_values(entry["latency"])
+            for (column, value) in values.items():
+                row[column] = value
+            rows.append(row)
+            if not self.mirror_cache.is_fresh(entry, "latency"):
+                stale_urls.append(mirror.url)
+
+        GObject.idle_add(self._append_rows, rows, stale_urls, self._generation)
+
+    def _append_rows(self, rows, stale_urls, generation):
+        # Fill the list a batch at a time, so the UI stays responsive with hundreds of mirrors
+        if generation != self._generation:
             return False
-        mirror_date = datetime.datetime.fromtimestamp(mirror_timestamp)
-        mirror_age = (self.default_mirror_date - mirror_date).days
-        if (mirror_age > 2):
-            print ("Error: %s is out of date by %d days!" % (url, mirror_age))
-            return False
-        else:
-            # Age is fine :)
+        for row in rows[:MIRROR_LIST_BATCH_SIZE]:
+            self._iters[row[MirrorSelectionDialog.MIRROR_URL_COLUMN]] = self._mirrors_model.append(row)
+        del rows[:MIRROR_LIST_BATCH_SIZE]
+        if len(rows) > 0:
             return True
 
-    @async
-    def _all_speed_tests(self):
-        model_iters = [] # Don't iterate through iters directly.. we're modifying their orders..
-        iter = self._mirrors_model.get_iter_first()
-        while iter is not None:
-            model_iters.append(iter)
-            iter = self._mirrors_model.iter_next(iter)
-
-        for iter in model_iters:
-            try:
-                if iter is not None:
-                    mirror = self._mirrors_model.get_value(iter, MirrorSelectionDialog.MIRROR_COLUMN)
-                    if mirror in self.visible_mirrors:
-                        url = self._mirrors_model.get_value(iter, MirrorSelectionDialog.MIRROR_URL_COLUMN)
-                        self._speed_test (iter, url)
-            except Exception as e:
-                pass # null types will occur here...
-
-    def _get_speed_label(self, speed):
-        if speed > 0:
-            divider = (1024 * 1.0)
-            represented_speed = (speed / divider)   # translate it to kB/S
-            unit = _("kB/s")
-            if represented_speed > divider:
-                represented_speed = (represented_speed / divider)   # translate it to MB/S
-                unit = _("MB/s")
-            if represented_speed > divider:
-                represented_speed = (represented_speed / divider)   # translate it to GB/S
-                unit = _("GB/s")
-            num_int_digits = len("%d" % represented_speed)
-            if (num_int_digits > 2):
-                represented_speed = "%d %s" % (represented_speed, unit)
-            else:
-                represented_speed = "%.1f %s" % (represented_speed, unit)
-            represented_speed = represented_speed.replace(".0", "")
+        # The whole list is there, test the stale mirrors
+        workers = int(self.config["mirrors"].get("speed_test_workers", SPEED_TEST_WORKERS))
+        self.speed_test_pool = SpeedTestPool(max_workers=workers)
+        finished = threading.Event()
+        self._all_speed_tests(self.speed_test_pool, stale_urls, generation, finished)
+        GObject.timeout_add(MIRROR_LIST_UPDATE_INTERVAL, self._flush_results, generation, finished)
+        return False
+
+    @_async
+    def _all_speed_tests(self, pool, urls, generation, finished):
+        # Results are queued as each test completes, and written to the model periodically
+        try:
+            self.tester.probe(urls, pool,
+                              on_latency=lambda url, latency: self._queue_result(url, self._get_latency_values(latency), generation),
+                              on_speed=lambda url, speed: self._queue_result(url, self._get_speed_values(speed), generation))
+        finally:
+            finished.set()
+        self.mirror_cache.save()
+
+    def _queue_result(self, url, values, generation):
+        with self._pending_results_lock:
+            if generation == self._generation:
+                self._pending_results.setdefault(url, {}).update(values)
+
+    def _flush_results(self, generation, finished):
+        if generation != self._generation:
+            return False
+        with self._pending_results_lock:
+            results = self._pending_results
+            self._pending_results = {}
+        if len(results) > 0:
+            update_model_rows(self._mirrors_model, self._iters, results)
+        # Keep going until the last result is written
+        return not finished.is_set() or len(self._pending_results) > 0
+
+    def _get_latency_values(self, latency):
+        if latency is None:
+            return {MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: _("Unreachable")}
+        elif latency == -1:
+            return {MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: _("Obsolete")}
         else:
-            represented_speed = ("0 %s") % _("kB/s")
-        return represented_speed
+            return {MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: _("%d ms") % (latency * 1000)}
 
-    def _speed_test(self, iter, url):
-        download_speed = 0
-        try:
-            if self.is_base:
-                test_url = "%s/dists/%s/main/binary-amd64/Packages.gz" % (url, self.codename)
-            else:
-                test_url = "%s/dists/%s/main/Contents-amd64.gz" % (url, self.codename)
-            if (self.is_base or self.check_mirror_up_to_date("%s/db/version" % url)):
-                c = pycurl.Curl()
-                buff = BytesIO()
-                c.setopt(pycurl.URL, test_url)
-                c.setopt(pycurl.CONNECTTIMEOUT, 5)
-                c.setopt(pycurl.TIMEOUT, 20)
-                c.setopt(pycurl.FOLLOWLOCATION, 1)
-                c.setopt(pycurl.WRITEFUNCTION, buff.write)
-                c.setopt(pycurl.NOSIGNAL, 1)
-                c.perform()
-                download_speed = c.getinfo(pycurl.SPEED_DOWNLOAD) # bytes/sec
-            else:
-                # the mirror is not up to date
-                download_speed = -1
-        except Exception as error:
-            print ("Error '%s' on url %s" % (error, url))
-            download_speed = 0
+    def _get_speed_values(self, download_speed):
+        if download_speed == -1:
+            return {MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: _("Obsolete")}
+        elif download_speed == 0:
+            return {MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: _("Unreachable")}
+        else:
+            return {MirrorSelectionDialog.MIRROR_SPEED_COLUMN: download_speed,
+                    MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN: get_speed_label(download_speed)}
 
-        self.show_speed_test_result(iter, download_speed)
+    @_async
+    def _lookup_country(self, generation):
+        country_code = lookup_country_code()
+        if country_code is not None:
+            self._relocate(country_code, generation)
 
     @idle
-    def show_speed_test_result(self, iter, download_speed):
-        if (iter is not None): # recheck as it can get null
-            if download_speed == -1:
-                # don't remove from model as this is not thread-safe
-                self._mirrors_model.set_value(iter, MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN, _("Obsolete"))
-            if download_speed == 0:
-                # don't remove from model as this is not thread-safe
-                self._mirrors_model.set_value(iter, MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN, _("Unreachable"))
-            else:
-                self._mirrors_model.set_value(iter, MirrorSelectionDialog.MIRROR_SPEED_COLUMN, download_speed)
-                self._mirrors_model.set_value(iter, MirrorSelectionDialog.MIRROR_SPEED_LABEL_COLUMN, self._get_speed_label(download_speed))
+    def _relocate(self, country_code, generation):
+        # Only while the dialog which asked is still open
+        if generation == self._generation and country_code != self.local_country_code:
+            self.local_country_code = country_code
+            self.visible_mirrors = sort_mirrors_by_location(self.mirrors, get_country_index(), self.local_country_code, self.default_mirror)
+            self._update_list()
 
     def run(self, mirrors, config, is_base):
 
         self.config = config
         self.is_base = is_base
-        if self.is_base:
-            self.codename = self.config["general"]["base_codename"]
-            self.default_mirror = self.config["mirrors"]["base_default"]
-        else:
-            self.codename = self.config["general"]["codename"]
-            self.default_mirror = self.config["mirrors"]["default"]
-
-        # Try to find out where we're located...
-        try:
-            lookup = str(urlopen('http://geoip.ubuntu.com/lookup').read())
-            cur_country_code = re.search('<CountryCode>(.*)</CountryCode>', lookup).group(1)
-            if cur_country_code == 'None': cur_country_code = None
-        except Exception as detail:
-            cur_country_code = None  # no internet connection
-
-        self.local_country_code = cur_country_code or os.environ.get('LANG', 'US').split('.')[0].split('_')[-1]  # fallback to LANG location or 'US'
-
-        self.bordering_countries = []
-        self.subregion = []
-        self.region = []
-        self.local_country = self.get_country(self.local_country_code)
-        if self.local_country is not None:
-            for country in self.countries:
-                country_code = country["cca2"]
-                if country["region"] == self.local_country["region"]:
-                    if country["subregion"] == self.local_country["subregion"]:
-                        self.subregion.append(country_code)
-                    else:
-                        self.region.append(country_code)
-                if country["cca3"] in self.local_country["borders"]:
-                    self.bordering_countries.append(country_code)
-
-        self.worldwide_mirrors = []
-        self.local_mirrors = []
-        self.bordering_mirrors = []
-        self.subregional_mirrors = []
-        self.regional_mirrors = []
-        self.official_mirrors = []
-        self.other_mirrors = []
-
-        for mirror in mirrors:
-            if mirror.country_code == "WD":
-                self.worldwide_mirrors.append(mirror)
-                print (mirror)
-            elif mirror.country_code == self.local_country_code:
-                self.local_mirrors.append(mirror)
-            elif mirror.country_code in self.bordering_countries:
-                self.bordering_mirrors.append(mirror)
-            elif mirror.country_code in self.subregion:
-                self.subregional_mirrors.append(mirror)
-            elif mirror.country_code in self.region:
-                self.regional_mirrors.append(mirror)
-            elif mirror.url == self.default_mirror:
-                self.official_mirrors.append(mirror)
-            else:
-                self.other_mirrors.append(mirror)
-
-        self.worldwide_mirrors = sorted(self.worldwide_mirrors, key=lambda x: x.country_code)
-        self.bordering_mirrors = sorted(self.bordering_mirrors, key=lambda x: x.country_code)
-        self.subregional_mirrors = sorted(self.subregional_mirrors, key=lambda x: x.country_code)
-        self.regional_mirrors = sorted(self.regional_mirrors, key=lambda x: x.country_code)
-
-        self.visible_mirrors = self.worldwide_mirrors + self.local_mirrors + self.bordering_mirrors + self.subregional_mirrors + self.regional_mirrors + self.official_mirrors
-
-        if self.local_country_code in ["IL"]:
-            # For some countries, geographical proximity doesn't equate to faster mirrors.
-            self.visible_mirrors = self.visible_mirrors + self.other_mirrors
-
-        if len(self.visible_mirrors) < 2:
-            # We failed to identify the continent/country, let's show all mirrors
-            self.visible_mirrors = mirrors
-
-        # Try to find the age of the Mint archive
-        self.default_mirror_age = None
-        self.default_mirror_date = None
-        mirror_timestamp = self.get_url_last_modified("%s/db/version" % self.default_mirror)
-        if mirror_timestamp is not None:
-            self.default_mirror_date = datetime.datetime.fromtimestamp(mirror_timestamp)
-            now = datetime.datetime.now()
-            self.default_mirror_age = (now - self.default_mirror_date).days
+        self.tester = MirrorTester(self.config, self.is_base, self.mirror_cache)
+        self.codename = self.tester.codename
+        self.default_mirror = self.tester.default_mirror
+
+        # Start from the cached or offline location, GeoIP can re-sort the list later
+        self.mirrors = mirrors
+        self.local_country_code = read_cached_country_code()
+        if self.local_country_code is None:
+            self.local_country_code = get_offline_country_code()
+            self._lookup_country(self._generation + 1)
+        self.visible_mirrors = sort_mirrors_by_location(mirrors, get_country_index(), self.local_country_code, self.default_mirror)
 
         self._update_list()
         self._dialog.show_all()
@@ -690,6 +2840,10 @@ class MirrorSelectionDialog(object):
                 res = None
         else:
             res = None
+        self._generation += 1
+        if self.speed_test_pool is not None:
+            self.speed_test_pool.cancel()
+        self.mirror_cache.save()
         self._dialog.hide()
         self._mirrors_model.clear()
         return res
@@ -702,7 +2856,7 @@ class Application(object):
 
         self.infobar_visible = False
 
-        self.lsb_codename = subprocess.getoutput("lsb_release -sc")
+        self.lsb_codename = get_platform_info().get_codename()
 
         glade_file = "/usr/lib/linuxmint/mintSources/mintSources.glade"
 
@@ -720,27 +2874,15 @@ class Application(object):
 
         self.apt = mintcommon.APT(self._main_window)
 
-        config_parser = configparser.RawConfigParser()
-        config_parser.read("/usr/share/mintsources/%s/mintsources.conf" % self.lsb_codename)
-        self.config = {}
+        (self.config, optional_components, self.system_keys) = get_platform_info().get_mintsources_config(self.lsb_codename)
         self.optional_components = []
-        self.system_keys = []
-        for section in config_parser.sections():
-            if section.startswith("optional_component"):
-                component_name = config_parser.get(section, "name")
-                component_description = config_parser.get(section, "description")
-                if component_name in ["backport", "backports"]:
-                    component_description = "%s (%s)" % (_("Backported packages"), component_name)
-                elif component_name in ["romeo", "unstable"]:
-                    component_description = "%s (%s)" % (_("Unstable packages"), component_name)
-                component = Component(component_name, component_description, False)
-                self.optional_components.append(component)
-            elif section.startswith("key"):
-                self.system_keys.append(config_parser.get(section, "pub"))
-            else:
-                self.config[section] = {}
-                for param in config_parser.options(section):
-                    self.config[section][param] = config_parser.get(section, param)
+        for (component_name, component_description) in optional_components:
+            if component_name in ["backport", "backports"]:
+                component_description = "%s (%s)" % (_("Backported packages"), component_name)
+            elif component_name in ["romeo", "unstable"]:
+                component_description = "%s (%s)" % (_("Unstable packages"), component_name)
+            component = Component(component_name, component_description, False)
+            self.optional_components.append(component)
 
         if self.config["general"]["use_ppas"] == "false":
             self.builder.get_object("vbuttonbox1").remove(self.builder.get_object("toggle_ppas"))
@@ -766,45 +2908,27 @@ class Application(object):
             for i in range(len(self.optional_components)):
                 component = self.optional_components[i]
                 cb = ComponentToggleCheckBox(self, component, self._main_window)
-                component.set_widget(cb)
-                components_table.attach(cb, 0, 1, nb_components, nb_components + 1)
+                component.set_widget(cb.widget)
+                components_table.attach(cb.widget, 0, 1, nb_components, nb_components + 1)
                 nb_components += 1
 
-        self.mirrors = self.read_mirror_list(self.config["mirrors"]["mirrors"])
-        self.base_mirrors = self.read_mirror_list(self.config["mirrors"]["base_mirrors"])
+        self.mirrors = read_mirror_list(self.config["mirrors"]["mirrors"])
+        self.base_mirrors = read_mirror_list(self.config["mirrors"]["base_mirrors"])
+        flag_cache.preload(set(mirror.country_code for mirror in self.mirrors + self.base_mirrors))
 
         self.repositories = []
         self.ppas = []
 
-        source_files = []
-        if os.path.exists("/etc/apt/sources.list"):
-            source_files.append("/etc/apt/sources.list")
-        for file in os.listdir("/etc/apt/sources.list.d"):
-            if file.endswith(".list"):
-                source_files.append("/etc/apt/sources.list.d/%s" % file)
-
-        if "/etc/apt/sources.list.d/official-package-repositories.list" in source_files:
-            source_files.remove("/etc/apt/sources.list.d/official-package-repositories.list")
-
-        if "/etc/apt/sources.list.d/official-source-repositories.list" in source_files:
-            source_files.remove("/etc/apt/sources.list.d/official-source-repositories.list")
-
+        source_files = list_source_files()
+        self.sources_index = SourcesIndex()
+        self.sources_index.load(source_files)
+        self._sources_flush_queued = False
+        self._official_sources_changed = False
         for source_file in source_files:
-            file = open(source_file, "r")
-            for line in file.readlines():
-                line = line.strip()
-                if line != "":
-                    selected = True
-                    if line.startswith("#"):
-                        line = line.replace('#', '').strip()
-                        selected = False
-                    if line.startswith("deb"):
-                        repository = Repository(self, line, source_file, selected)
-                        if "ppa.launchpad" in line and self.config["general"]["use_ppas"] != "false":
-                            self.ppas.append(repository)
-                        else:
-                            self.repositories.append(repository)
-            file.close()
+            source_file = self.sources_index.get_file(source_file)
+            for (line_number, line, selected) in source_file.get_entries():
+                repository = Repository(self, line, source_file, line_number, selected)
+                self._get_repository_list(repository).append(repository)
 
         # Add PPAs
         self._ppa_model = Gtk.ListStore(object, bool, str)
@@ -869,9 +2993,11 @@ class Application(object):
         self._keys_treeview.append_column(col)
         col.set_sort_column_id(1)
 
+        self.keys = []
+        self.key_index = KeyIndex()
         self.load_keys()
 
-        if not os.path.exists("/etc/apt/sources.list.d/official-package-repositories.list"):
+        if not os.path.exists(OFFICIAL_PACKAGES_PATH):
             print ("Sources missing, generating default sources list!")
             self.generate_missing_sources()
 
@@ -887,7 +3013,7 @@ class Application(object):
             self.builder.get_object("toggle_maintenance")
         ]
 
-        self._main_window.connect("delete_event", lambda w,e: Gtk.main_quit())
+        self._main_window.connect("delete_event", self._on_quit)
         for i in range(len(self._tab_buttons)):
             self._tab_buttons[i].connect("clicked", self._on_tab_button_clicked, i)
             self._tab_buttons[i].set_active(False)
@@ -917,9 +3043,85 @@ class Application(object):
         self.builder.get_object("button_remove_foreign").connect("clicked", self.remove_foreign)
         self.builder.get_object("button_downgrade_foreign").connect("clicked", self.downgrade_foreign)
 
+        # Pick up changes made to the sources by other tools
+        self.sources_watcher = SourcesWatcher(["/etc/apt/sources.list", "/etc/apt/sources.list.d"], self.rescan_sources)
+
         # From now on, we handle modifications to the settings and save them when they happen
         self._interface_loaded = True
 
+    def _get_repository_list(self, repository):
+        if repository.deb is not None and "ppa.launchpad" in repository.deb.uri and self.config["general"]["use_ppas"] != "false":
+            return self.ppas
+        else:
+            return self.repositories
+
+    def _get_repository_model(self, repository):
+        if self._get_repository_list(repository) is self.ppas:
+            return self._ppa_model
+        else:
+            return self._repository_model
+
+    def _get_repository_label(self, repository):
+        if self._get_repository_list(repository) is self.ppas:
+            return repository.get_ppa_name()
+        else:
+            return repository.get_repository_name()
+
+    def _find_repository_iter(self, repository):
+        model = self._get_repository_model(repository)
+        iter = model.get_iter_first()
+        while iter is not None:
+            if model.get_value(iter, 0) is repository:
+                return iter
+            iter = model.iter_next(iter)
+        return None
+
+    def rescan_sources(self):
+        # Only re-parse the files which changed on disk, and apply the difference to the lists and the views
+        paths = list_source_files()
+        for (path, source_file) in list(self.sources_index.files.items()):
+            if path not in paths and not source_file.dirty and not os.path.exists(path):
+                self._reload_source_file(self.sources_index.remove_file(path), None)
+        for path in paths:
+            source_file = self.sources_index.files.get(path)
+            if source_file is None:
+                self._reload_source_file(None, self.sources_index.get_file(path))
+            elif not source_file.dirty and source_file.has_changed_on_disk():
+                self.sources_index.remove_file(path)
+                self._reload_source_file(source_file, self.sources_index.get_file(path))
+
+    def _reload_source_file(self, old_file, new_file):
+        old_repositories = {}
+        if old_file is not None:
+            for repository in self.repositories + self.ppas:
+                if repository.source_file is old_file:
+                    old_repositories.setdefault(repository.line, []).append(repository)
+
+        if new_file is not None:
+            for (line_number, line, selected) in new_file.get_entries():
+                if len(old_repositories.get(line, [])) > 0:
+                    # Same entry, it may have moved or been toggled
+                    repository = old_repositories[line].pop(0)
+                    repository.source_file = new_file
+                    repository.line_number = line_number
+                    if repository.selected != selected:
+                        repository.selected = selected
+                        iter = self._find_repository_iter(repository)
+                        if iter is not None:
+                            self._get_repository_model(repository).set_value(iter, 1, selected)
+                else:
+                    repository = Repository(self, line, new_file, line_number, selected)
+                    self._get_repository_list(repository).append(repository)
+                    self._get_repository_model(repository).append((repository, repository.selected, self._get_repository_label(repository)))
+
+        # Whatever is left was removed from the file
+        for repositories in old_repositories.values():
+            for repository in repositories:
+                iter = self._find_repository_iter(repository)
+                if iter is not None:
+                    self._get_repository_model(repository).remove(iter)
+                self._get_repository_list(repository).remove(repository)
+
     def set_button_text(self, label, text):
         label.set_text(text)
         if len(text) > BUTTON_LABEL_MAX_LENGTH:
@@ -927,30 +3129,6 @@ class Application(object):
             label.set_max_width_chars(BUTTON_LABEL_MAX_LENGTH)
             label.set_ellipsize(Pango.EllipsizeMode.END)
 
-    def read_mirror_list(self, path):
-        mirror_list = []
-        country_code = None
-        mirrorsfile = open(path, "r")
-        for line in mirrorsfile.readlines():
-            line = line.strip()
-            if line != "":
-                if ("#LOC:" in line):
-                    country_code = line.split(":")[1]
-                else:
-                    if country_code is not None:
-                        if ("ubuntu-ports" not in line):
-                            elements = line.split(" ")
-                            url = elements[0]
-                            if len(elements) > 1:
-                                name = " ".join(elements[1:])
-                            else:
-                                name = url
-                            if url[-1] == "/":
-                                url = url[:-1]
-                            mirror = Mirror(country_code, url, name)
-                            mirror_list.append(mirror)
-        return mirror_list
-
     def remove_foreign(self, widget):
         os.system("/usr/lib/linuxmint/mintSources/foreign_packages.py remove &")
 
@@ -964,42 +3142,28 @@ class Application(object):
         self.show_confirmation_dialog(self._main_window, _("There is no more residual configuration on the system."), image, affirmation=True)
 
     def fix_mergelist(self, widget):
-        os.system("rm /var/lib/apt/lists/* -vf")
+        clear_directory("/var/lib/apt/lists")
         image = Gtk.Image()
         image.set_from_icon_name("mintsources-maintenance", Gtk.IconSize.DIALOG)
         self.show_confirmation_dialog(self._main_window, _("The problem was fixed. Please reload the cache."), image, affirmation=True)
         self.enable_reload_button()
 
+    @_async
     def load_keys(self):
-        self.keys = []
-        key = None
-        output = subprocess.getoutput("apt-key list")
-        lines = []
-        for line in output.split("\n"):
-            line = line.strip()
-            if line.startswith("/etc/apt"):
-                continue
-            if line.startswith("-----"):
-                continue
-            if line == "":
-                continue
-            lines.append(line)
-
-        for key_data in "\n".join(lines).split("pub   "):
-            key_data = key_data.split("\n")
-            if len(key_data) > 3:
-                extra = key_data[0]
-                pub = key_data[1]
-                pub_short = "".join(pub.split()[-2:])
-                name = key_data[2]
-                name = name.replace("uid ", "")
-                if "]" in name:
-                    name = name.split("]")[1].strip()
-                key = Key(pub_short)
-                key.uid = name
-                if pub_short not in self.system_keys:
-                    self.keys.append(key)
+        # Only the keyrings which changed since the last call are read again
+        keys = []
+        for (fingerprint, uid, keyring) in self.key_index.refresh():
+            key = Key(fingerprint[-8:])
+            key.uid = uid
+            key.fingerprint = fingerprint
+            key.keyring = keyring
+            if key.pub not in self.system_keys:
+                keys.append(key)
+        self._show_keys(keys)
 
+    @idle
+    def _show_keys(self, keys):
+        self.keys = keys
         self._keys_model.clear()
         for key in self.keys:
             tree_iter = self._keys_model.append((key, key.get_name()))
@@ -1023,9 +3187,18 @@ class Application(object):
         image.set_from_icon_name("mintsources-keys", Gtk.IconSize.DIALOG)
         line = self.show_entry_dialog(self._main_window, _("Please enter the 8 characters of the public key you want to download from keyserver.ubuntu.com:"), "", image)
         if line is not None:
-            res = os.system("apt-key adv --keyserver keyserver.ubuntu.com --recv-keys %s" % line)
-            self.load_keys()
-            self.enable_reload_button()
+            self._fetch_keys([line])
+
+    @_async
+    def _fetch_keys(self, key_ids):
+        self._on_keys_fetched(list(KeyFetcher().install(key_ids).values()))
+
+    @idle
+    def _on_keys_fetched(self, errors):
+        if len(errors) > 0:
+            self.show_error_dialog(self._main_window, "\n".join(errors))
+        self.load_keys()
+        self.enable_reload_button()
 
     def remove_key(self, widget):
         selection = self._keys_treeview.get_selection()
@@ -1050,44 +3223,32 @@ class Application(object):
 
         line = self.show_entry_dialog(self._main_window, _("Please enter the name of the PPA you want to add:"), start_line, image)
         if line is not None:
-            user, sep, ppa_name = line.split(":")[1].partition("/")
-            ppa_name = ppa_name or "ppa"
-            try:
-                ppa_info = get_ppa_info_from_lp(user, ppa_name, self.config["general"]["base_codename"])
-            except Exception as detail:
-                self.show_error_dialog(self._main_window, _("Cannot add PPA: '%s'.") % detail)
-                return
-
-            image = Gtk.Image()
-            image.set_from_icon_name("mintsources-ppa", Gtk.IconSize.DIALOG)
-            info_text = "%s\n\n%s\n\n%s\n\n%s" % (line, self.format_string(ppa_info["displayname"]), self.format_string(ppa_info["description"]), str(ppa_info["web_link"]))
-            if self.show_confirm_ppa_dialog(self._main_window, info_text):
-                (deb_line, file) = expand_ppa_line(line.strip(), self.config["general"]["base_codename"])
-                deb_line = expand_http_line(deb_line, self.config["general"]["base_codename"])
-                debsrc_line = 'deb-src' + deb_line[3:]
-
-                # Add the key
-                short_key = ppa_info["signing_key_fingerprint"][-8:]
-                os.system("apt-key adv --keyserver keyserver.ubuntu.com --recv-keys %s" % short_key)
-                self.load_keys()
-
-                # Add the PPA in sources.list.d
-                with open(file, "w") as text_file:
-                    text_file.write("%s\n" % deb_line)
-                    text_file.write("%s\n" % "# "+debsrc_line)
+            self._lookup_ppa(line)
 
-                # Add the package line in the UI
-                repository = Repository(self, deb_line, file, True)
-                self.ppas.append(repository)
-                tree_iter = self._ppa_model.append((repository, repository.selected, repository.get_ppa_name()))
-
-                # Add the source line in the UI
-                repository = Repository(self, debsrc_line, file, False)
-                self.ppas.append(repository)
-                tree_iter = self._ppa_model.append((repository, repository.selected, repository.get_ppa_name()))
-
-                self.enable_reload_button()
+    @_async
+    def _lookup_ppa(self, line):
+        user, sep, ppa_name = line.split(":")[1].partition("/")
+        ppa_name = ppa_name or "ppa"
+        try:
+            ppa_info = get_ppa_info_from_lp(user, ppa_name, self.config["general"]["base_codename"])
+        except Exception as detail:
+            self._on_ppa_looked_up(line, None, detail)
+            return
+        self._on_ppa_looked_up(line, ppa_info, None)
 
+    @idle
+    def _on_ppa_looked_up(self, line, ppa_info, error):
+        if error is not None:
+            self.show_error_dialog(self._main_window, _("Cannot add PPA: '%s'.") % error)
+            return
+        image = Gtk.Image()
+        image.set_from_icon_name("mintsources-ppa", Gtk.IconSize.DIALOG)
+        info_text = "%s\n\n%s\n\n%s\n\n%s" % (line, self.format_string(ppa_info["displayname"]), self.format_string(ppa_info["description"]), str(ppa_info["web_link"]))
+        if self.show_confirm_ppa_dialog(self._main_window, info_text):
+            transaction = self.create_transaction()
+            transaction.ppa_info[line.strip()] = ppa_info
+            transaction.add(line, source_code=False)
+            self.apply_transaction(transaction, self.load_keys)
 
     def format_string(self, text):
         if text is None:
@@ -1102,7 +3263,11 @@ class Application(object):
             repository = model.get(iter, 0)[0]
             url = self.show_entry_dialog(self._main_window, _("Edit the URL of the PPA"), repository.line)
             if url is not None:
-                repository.edit(url)
+                try:
+                    repository.edit(url)
+                except SourceException as detail:
+                    self.show_error_dialog(self._main_window, str(detail))
+                    return
                 model.set_value(iter, 2, repository.get_ppa_name())
 
     def remove_ppa(self, widget):
@@ -1122,7 +3287,7 @@ class Application(object):
             if (iter != None):
                 repository = model.get_value(iter, 0)
                 ppa_name = model.get_value(iter, 2)
-                if repository.line.startswith("deb http://ppa.launchpad.net"):
+                if repository.get_ppa_info() is not None and repository.deb.type == "deb":
                     self.builder.get_object("button_ppa_examine").set_sensitive(True)
         except Exception as detail:
             print (detail)
@@ -1137,18 +3302,15 @@ class Application(object):
             if (iter != None):
                 repository = model.get_value(iter, 0)
                 ppa_name = model.get_value(iter, 2)
-                if repository.line.startswith("deb http://ppa.launchpad.net"):
-                    line = repository.line.split()[1].replace("http://ppa.launchpad.net/", "")
-                    if line.endswith("/ubuntu"):
-                        line = line[:-7]
-                        ppa_owner, ppa_name = line.split("/")
-                        architecture = subprocess.getoutput("dpkg --print-architecture")
-                        ppa_file = "/var/lib/apt/lists/ppa.launchpad.net_%s_%s_ubuntu_dists_%s_main_binary-%s_Packages" % (ppa_owner, ppa_name, self.config["general"]["base_codename"], architecture)
-                        if os.path.exists(ppa_file):
-                            os.system("/usr/lib/linuxmint/mintSources/ppa_browser.py %s %s %s &" % (self.config["general"]["base_codename"], ppa_owner, ppa_name))
-                        else:
-                            print ("%s not found!" % ppa_file)
-                            self.show_error_dialog(self._main_window, _("The content of this PPA is not available. Please refresh the cache and try again."))
+                if repository.get_ppa_info() is not None and repository.deb.type == "deb":
+                    ppa_owner, ppa_name = repository.get_ppa_info()
+                    architecture = get_platform_info().get_architecture()
+                    ppa_file = "/var/lib/apt/lists/ppa.launchpad.net_%s_%s_ubuntu_dists_%s_main_binary-%s_Packages" % (ppa_owner, ppa_name, self.config["general"]["base_codename"], architecture)
+                    if os.path.exists(ppa_file):
+                        os.system("/usr/lib/linuxmint/mintSources/ppa_browser.py %s %s %s &" % (self.config["general"]["base_codename"], ppa_owner, ppa_name))
+                    else:
+                        print ("%s not found!" % ppa_file)
+                        self.show_error_dialog(self._main_window, _("The content of this PPA is not available. Please refresh the cache and try again."))
         except Exception as detail:
             print (detail)
 
@@ -1164,16 +3326,9 @@ class Application(object):
 
         line = self.show_entry_dialog(self._main_window, _("Please enter the name of the repository you want to add:"), start_line, image)
         if line is not None and line.strip().startswith("deb"):
-            # Add the repository in sources.list.d
-            with open("/etc/apt/sources.list.d/additional-repositories.list", "a") as text_file:
-                text_file.write("%s\n" % line)
-
-            # Add the line in the UI
-            repository = Repository(self, line, "/etc/apt/sources.list.d/additional-repositories.list", True)
-            self.repositories.append(repository)
-            tree_iter = self._repository_model.append((repository, repository.selected, repository.get_repository_name()))
-
-            self.enable_reload_button()
+            transaction = self.create_transaction()
+            transaction.add(line)
+            self.apply_transaction(transaction)
 
 
     def edit_repository(self, widget):
@@ -1183,7 +3338,11 @@ class Application(object):
             repository = model.get(iter, 0)[0]
             url = self.show_entry_dialog(self._main_window, _("Edit the URL of the repository"), repository.line)
             if url is not None:
-                repository.edit(url)
+                try:
+                    repository.edit(url)
+                except SourceException as detail:
+                    self.show_error_dialog(self._main_window, str(detail))
+                    return
                 model.set_value(iter, 2, repository.get_repository_name())
 
     def remove_repository(self, widget):
@@ -1356,6 +3515,10 @@ class Application(object):
         self._main_window.show_all()
         Gtk.main()
 
+    def _on_quit(self, window, event):
+        self.save_sources()
+        Gtk.main_quit()
+
     def revert_to_default_sources(self, widget):
         self.selected_mirror = self.config["mirrors"]["default"]
         self.builder.get_object("label_mirror_name").set_text(self.selected_mirror)
@@ -1369,6 +3532,56 @@ class Application(object):
 
         self.apply_official_sources()
 
+    def create_transaction(self):
+        return SourcesTransaction(self.lsb_codename, self.config, [component.name for component in self.optional_components], self.sources_index)
+
+    def apply_transaction(self, transaction, callback=None):
+        # Checks the changes and fetches their keys in the background, then applies them to the sources
+        # and the lists. They're saved with the next save_sources(). The callback is called if they were applied.
+        self._check_transaction(transaction, callback)
+
+    @_async
+    def _check_transaction(self, transaction, callback):
+        errors = transaction.validate()
+        if len(errors) == 0:
+            # Without its key, a new PPA would break apt update, so the keys come first
+            errors = list(transaction.fetch_keys().values())
+        self._on_transaction_checked(transaction, callback, errors)
+
+    @idle
+    def _on_transaction_checked(self, transaction, callback, errors):
+        if len(errors) > 0:
+            self.show_error_dialog(self._main_window, "\n".join(errors))
+            return
+        transaction.apply()
+        for source_file in transaction.touched_files:
+            self._reload_source_file(source_file, source_file)
+        self.sources_changed()
+        if callback is not None:
+            callback()
+
+    def sources_changed(self):
+        # Changes made in the same main loop iteration are written together
+        if not self._sources_flush_queued:
+            self._sources_flush_queued = True
+            GObject.idle_add(self.save_sources)
+
+    def save_sources(self):
+        self._sources_flush_queued = False
+        transaction = self.create_transaction()
+        if self._official_sources_changed:
+            self._official_sources_changed = False
+            selected_components = [component.name for component in self.optional_components if component.selected]
+            transaction.set_official_sources(selected_components, self.selected_mirror, self.selected_base_mirror, self.builder.get_object("source_code_cb").get_active())
+        try:
+            # The APT cache only needs reloading if something was written
+            errors = transaction.commit(refresh=self.enable_reload_button)
+            if len(errors) > 0:
+                self.show_error_dialog(self._main_window, "\n".join(errors))
+        except (IOError, OSError) as detail:
+            self.show_error_dialog(self._main_window, _("Cannot save the repositories: '%s'.") % detail)
+        return False
+
     def enable_reload_button(self):
         if not self.infobar_visible:
             self.infobar_visible = True
@@ -1384,6 +3597,7 @@ class Application(object):
             infobar.show_all()
 
     def _on_infobar_response(self, infobar, response_id):
+        self.save_sources()
         infobar.destroy()
         self.infobar_visible = False
         self.apt.update_cache()
@@ -1395,76 +3609,22 @@ class Application(object):
 
         self.update_flags()
 
-        # Check which components are selected
-        selected_components = []
-        for component in self.optional_components:
-            if component.selected:
-                selected_components.append(component.name)
-
-        # Update official packages repositories
-        os.system("rm -f /etc/apt/sources.list.d/official-package-repositories.list")
-        template = open('/usr/share/mintsources/%s/official-package-repositories.list' % self.lsb_codename, 'r').read()
-        template = template.replace("$codename", self.config["general"]["codename"])
-        template = template.replace("$basecodename", self.config["general"]["base_codename"])
-        template = template.replace("$optionalcomponents", ' '.join(selected_components))
-        template = template.replace("$mirror", self.selected_mirror)
-        template = template.replace("$basemirror", self.selected_base_mirror)
-
-        with open("/etc/apt/sources.list.d/official-package-repositories.list", "w") as text_file:
-            text_file.write(template)
-
-        # Update official sources repositories
-        os.system("rm -f /etc/apt/sources.list.d/official-source-repositories.list")
-        if (self.builder.get_object("source_code_cb").get_active()):
-            template = open('/usr/share/mintsources/%s/official-source-repositories.list' % self.lsb_codename, 'r').read()
-            template = template.replace("$codename", self.config["general"]["codename"])
-            template = template.replace("$basecodename", self.config["general"]["base_codename"])
-            template = template.replace("$optionalcomponents", ' '.join(selected_components))
-            template = template.replace("$mirror", self.selected_mirror)
-            template = template.replace("$basemirror", self.selected_base_mirror)
-            with open("/etc/apt/sources.list.d/official-source-repositories.list", "w") as text_file:
-                text_file.write(template)
-
-        self.enable_reload_button()
+        # Written with the other sources, by save_sources()
+        self._official_sources_changed = True
+        self.sources_changed()
 
     def generate_missing_sources(self):
-        os.system("rm -f /etc/apt/sources.list.d/official-package-repositories.list")
-        os.system("rm -f /etc/apt/sources.list.d/official-source-repositories.list")
-
-        template = open('/usr/share/mintsources/%s/official-package-repositories.list' % self.lsb_codename, 'r').read()
-        template = template.replace("$codename", self.config["general"]["codename"])
-        template = template.replace("$basecodename", self.config["general"]["base_codename"])
-        template = template.replace("$optionalcomponents", '')
-        template = template.replace("$mirror", self.config["mirrors"]["default"])
-        template = template.replace("$basemirror", self.config["mirrors"]["base_default"])
-
-        with open("/etc/apt/sources.list.d/official-package-repositories.list", "w") as text_file:
-            text_file.write(template)
+        write_official_sources(self.lsb_codename, self.config, [], self.config["mirrors"]["default"], self.config["mirrors"]["base_default"], False)
 
     def detect_official_sources(self):
-        self.selected_mirror = self.config["mirrors"]["default"]
-        self.selected_base_mirror = self.config["mirrors"]["base_default"]
+        (self.selected_mirror, self.selected_base_mirror, selected_components, source_code) = read_official_sources(self.config, [component.name for component in self.optional_components])
 
         # Detect source code repositories
-        self.builder.get_object("source_code_cb").set_active(os.path.exists("/etc/apt/sources.list.d/official-source-repositories.list"))
-
-        listfile = open('/etc/apt/sources.list.d/official-package-repositories.list', 'r')
-        for line in listfile.readlines():
-            if (self.config["detection"]["main_identifier"] in line):
-                for component in self.optional_components:
-                    if component.name in line:
-                        component.widget.set_active(True)
-                elements = line.split(" ")
-                if elements[0] == "deb":
-                    mirror = elements[1]
-                    if "$" not in mirror:
-                        self.selected_mirror = mirror.rstrip('/')
-            if (self.config["detection"]["base_identifier"] in line):
-                elements = line.split(" ")
-                if elements[0] == "deb":
-                    mirror = elements[1]
-                    if "$" not in mirror:
-                        self.selected_base_mirror = mirror.rstrip('/')
+        self.builder.get_object("source_code_cb").set_active(source_code)
+
+        for component in self.optional_components:
+            if component.name in selected_components:
+                component.widget.set_active(True)
 
         self.builder.get_object("label_mirror_name").set_text(self.selected_mirror)
         self.builder.get_object("label_base_mirror_name").set_text(self.selected_base_mirror)
@@ -1493,7 +3653,7 @@ class Application(object):
                     flag = FLAG_PATH % '_united_nations'
                 else:
                     flag = FLAG_PATH % mirror.country_code.lower()
-                if os.path.exists(flag):
+                if flag_cache.exists(flag):
                     mint_flag_path = flag
                     break
 
@@ -1503,15 +3663,12 @@ class Application(object):
             else:
                 url = mirror.url
             if url in selected_base_mirror:
-                if os.path.exists(FLAG_PATH % mirror.country_code.lower()):
+                if flag_cache.exists(FLAG_PATH % mirror.country_code.lower()):
                     base_flag_path = FLAG_PATH % mirror.country_code.lower()
                     break
 
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(mint_flag_path, -1, FLAG_SIZE)
-        self.builder.get_object("image_mirror").set_from_pixbuf(pixbuf)
-
-        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(base_flag_path, -1, FLAG_SIZE)
-        self.builder.get_object("image_base_mirror").set_from_pixbuf(pixbuf)
+        self.builder.get_object("image_mirror").set_from_pixbuf(flag_cache.get_pixbuf(mint_flag_path))
+        self.builder.get_object("image_base_mirror").set_from_pixbuf(flag_cache.get_pixbuf(base_flag_path))
 
     def get_clipboard_text(self, source_type):
         clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
@@ -1522,7 +3679,7 @@ class Application(object):
             return None
 
 if __name__ == "__main__":
-    usage = "usage: %prog [options] [repository]"
+    usage = "usage: %prog [options] [add-apt-repository repository... | batch manifest.json | sync manifest | mirrors rank]"
     parser = OptionParser(usage=usage)
     #add a dummy option which can be easily ignored
     parser.add_option("-?", dest="ignore", action="store_true", default=False)
@@ -1530,10 +3687,22 @@ if __name__ == "__main__":
         help="force yes on all confirmation questions", default=False)
     parser.add_option("-r", "--remove", dest="remove", action="store_true",
         help="Remove the specified repository", default=False)
+    parser.add_option("-f", "--file", dest="file",
+        help="Read the repositories to add or remove from a file, one per line", default=None)
+    parser.add_option("--base", dest="base", action="store_true",
+        help="Rank the mirrors of the base archive instead of the main one", default=False)
+    parser.add_option("--json", dest="json", action="store_true",
+        help="Print the mirror ranking as JSON", default=False)
+    parser.add_option("--apply", dest="apply", action="store_true",
+        help="Switch to the fastest mirror", default=False)
+    parser.add_option("--dry-run", dest="dry_run", action="store_true",
+        help="Print the changes sync would make, without making them", default=False)
+    parser.add_option("--prune", dest="prune", action="store_true",
+        help="Make sync remove the repositories which aren't in the manifest", default=False)
 
     (options, args) = parser.parse_args()
 
-    lsb_codename = subprocess.getoutput("lsb_release -sc")
+    lsb_codename = get_platform_info().get_codename()
     config_dir = "/usr/share/mintsources/%s" % lsb_codename
     if not os.path.exists(config_dir):
         print ("LSB codename: '%s'." % lsb_codename)
@@ -1545,16 +3714,26 @@ if __name__ == "__main__":
         print ("Please check your LSB information with \"lsb_release -a\".")
         sys.exit(1)
 
-    if len(args) > 1 and (args[0] == "add-apt-repository"):
-        ppa_line = args[1]
-        lsb_codename = subprocess.getoutput("lsb_release -sc")
-        config_parser = configparser.RawConfigParser()
-        config_parser.read("/usr/share/mintsources/%s/mintsources.conf" % lsb_codename)
-        codename = config_parser.get("general", "base_codename")
-        use_ppas = config_parser.get("general", "use_ppas")
+    if len(args) > 0 and (args[0] == "add-apt-repository") and (len(args) > 1 or options.file is not None):
+        lines = args[1:]
+        if options.file is not None:
+            try:
+                lines += read_repository_lines(options.file)
+            except (IOError, OSError) as detail:
+                print (detail)
+                sys.exit(1)
+        (config, optional_components, system_keys) = get_platform_info().get_mintsources_config(lsb_codename)
+        codename = config["general"]["base_codename"]
         if options.remove:
-            remove_repository_via_cli(ppa_line, codename, options.forceYes)
+            for ppa_line in lines:
+                remove_repository_via_cli(ppa_line, codename, options.forceYes)
         else:
-            add_repository_via_cli(ppa_line, codename, options.forceYes, use_ppas)
+            add_repositories_via_cli(lines, lsb_codename, config, options.forceYes)
+    elif len(args) > 1 and args[0] == "batch":
+        apply_manifest_via_cli(lsb_codename, args[1])
+    elif len(args) > 1 and args[0] == "sync":
+        sync_manifest_via_cli(lsb_codename, args[1], options.dry_run, options.prune)
+    elif len(args) > 1 and args[0] == "mirrors" and args[1] == "rank":
+        rank_mirrors_via_cli(lsb_codename, options.base, options.json, options.apply)
     else:
         Application().run()
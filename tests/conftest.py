@@ -0,0 +1,70 @@
+import http.server
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+# mintSources.py is a script at the top of the repository, not an installed package
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+class StandInServer(http.server.ThreadingHTTPServer):
+    # A local HTTP server standing in for a mirror, a keyserver or Launchpad. handle(method, path, headers)
+    # returns (status, headers, body). Every request waits for delay seconds, and the server
+    # records the requests and how many it served at the same time.
+    daemon_threads = True
+
+    def __init__(self, handle, host="127.0.0.1", delay=0):
+        self.handle = handle
+        self.delay = delay
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        http.server.ThreadingHTTPServer.__init__(self, (host, 0), StandInHandler)
+        self.url = "http://%s:%d" % (host, self.server_port)
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _answer(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, dict(self.headers)))
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            time.sleep(server.delay)
+            (status, headers, body) = server.handle(self.command, self.path, self.headers)
+        finally:
+            with server.lock:
+                server.active -= 1
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = _answer
+    do_HEAD = _answer
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stand_in_server():
+    # Starts stand-in servers for the test, and stops them afterwards
+    servers = []
+    def start(handle, host="127.0.0.1", delay=0):
+        server = StandInServer(handle, host, delay)
+        threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+        servers.append(server)
+        return server
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
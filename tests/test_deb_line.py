@@ -0,0 +1,55 @@
+import pytest
+
+from mintSources import parse_deb_line
+
+# Lines parse_deb_line() must handle, with the expected (commented, type, options, uri, suite, components), or None
+DEB_LINE_CORPUS = [
+    ("deb http://packages.linuxmint.com virginia main upstream import backport",
+        (False, "deb", (), "http://packages.linuxmint.com", "virginia", ("main", "upstream", "import", "backport"))),
+    ("deb-src http://archive.ubuntu.com/ubuntu jammy main restricted",
+        (False, "deb-src", (), "http://archive.ubuntu.com/ubuntu", "jammy", ("main", "restricted"))),
+    ("  deb   http://archive.ubuntu.com/ubuntu   jammy   main  ",
+        (False, "deb", (), "http://archive.ubuntu.com/ubuntu", "jammy", ("main",))),
+    ("deb [arch=amd64] https://dl.google.com/linux/chrome/deb/ stable main",
+        (False, "deb", (("arch", "amd64"),), "https://dl.google.com/linux/chrome/deb/", "stable", ("main",))),
+    ("deb [arch=amd64,arm64 signed-by=/usr/share/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu jammy stable",
+        (False, "deb", (("arch", "amd64,arm64"), ("signed-by", "/usr/share/keyrings/docker.gpg")), "https://download.docker.com/linux/ubuntu", "jammy", ("stable",))),
+    ("deb [ trusted=yes ] file:/srv/repo ./",
+        (False, "deb", (("trusted", "yes"),), "file:/srv/repo", "./", ())),
+    ("deb cdrom:[Linux Mint 21.2 _Victoria_ - Release amd64 20230711]/ jammy main restricted",
+        (False, "deb", (), "cdrom:[Linux Mint 21.2 _Victoria_ - Release amd64 20230711]/", "jammy", ("main", "restricted"))),
+    ("#deb http://archive.canonical.com/ubuntu jammy partner",
+        (True, "deb", (), "http://archive.canonical.com/ubuntu", "jammy", ("partner",))),
+    ("# deb-src http://archive.ubuntu.com/ubuntu jammy universe",
+        (True, "deb-src", (), "http://archive.ubuntu.com/ubuntu", "jammy", ("universe",))),
+    ("## deb http://archive.ubuntu.com/ubuntu jammy multiverse",
+        (True, "deb", (), "http://archive.ubuntu.com/ubuntu", "jammy", ("multiverse",))),
+    ("deb http://archive.ubuntu.com/ubuntu jammy main # the main archive",
+        (False, "deb", (), "http://archive.ubuntu.com/ubuntu", "jammy", ("main",))),
+    ("deb http://archive.ubuntu.com/ubuntu jammy main#no space",
+        (False, "deb", (), "http://archive.ubuntu.com/ubuntu", "jammy", ("main",))),
+    ("deb http://archive.ubuntu.com/ubuntu jammy-security/",
+        (False, "deb", (), "http://archive.ubuntu.com/ubuntu", "jammy-security/", ())),
+    ("", None),
+    ("# See sources.list(5) for more information", None),
+    ("## Major bug fix updates produced after the final release", None),
+    ("deb", None),
+    ("deb http://archive.ubuntu.com/ubuntu", None),
+    ("deb [arch=amd64 http://archive.ubuntu.com/ubuntu jammy main", None),
+    ("deb-source http://archive.ubuntu.com/ubuntu jammy main", None),
+    ("rpm http://archive.ubuntu.com/ubuntu jammy main", None),
+    ("deb # http://archive.ubuntu.com/ubuntu jammy main", None),
+    ("Types: deb", None),
+]
+
+@pytest.mark.parametrize("text,expected", DEB_LINE_CORPUS)
+def test_parse_deb_line(text, expected):
+    deb = parse_deb_line(text)
+    if expected is None:
+        assert deb is None
+    else:
+        assert deb is not None
+        assert (deb.commented, deb.type, deb.options, deb.uri, deb.suite, deb.components) == expected
+
+def test_parse_deb_line_keeps_the_entry_without_comments():
+    assert parse_deb_line("# deb http://archive.ubuntu.com/ubuntu jammy main # note").line == "deb http://archive.ubuntu.com/ubuntu jammy main # note"
@@ -0,0 +1,40 @@
+import os
+import shutil
+import subprocess
+import sys
+
+from conftest import ROOT_DIR
+
+# Importing mintSources, as the command line modes do, must not load the GUI and
+# network libraries, nor take longer than the budget (compilation included)
+FORBIDDEN_MODULES = ["gi", "pycurl", "requests"]
+IMPORT_TIME_BUDGET = 0.25
+
+def import_with_importtime(directory):
+    # Returns [(cumulative seconds, module name)] as reported by python -X importtime. The module
+    # is imported from a copy which has no cached bytecode, like the script is when it's run.
+    shutil.copy(os.path.join(ROOT_DIR, "mintSources.py"), str(directory))
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    command = [sys.executable, "-X", "importtime", "-c", "import sys; sys.path.insert(0, %r); import mintSources" % str(directory)]
+    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, env=env)
+    assert process.returncode == 0, process.stderr
+    modules = []
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            modules.append((int(fields[1]) / 1000000, fields[2].strip()))
+    return modules
+
+def test_import_does_not_load_gui_or_network_libraries(tmp_path):
+    modules = import_with_importtime(tmp_path)
+    loaded = [name for (duration, name) in modules if name.split(".")[0] in FORBIDDEN_MODULES]
+    assert loaded == []
+
+def test_import_time_is_within_budget(tmp_path):
+    modules = import_with_importtime(tmp_path)
+    durations = [duration for (duration, name) in modules if name == "mintSources"]
+    assert len(durations) == 1
+    assert durations[0] < IMPORT_TIME_BUDGET, "mintSources took %.1f ms to import" % (durations[0] * 1000)
@@ -0,0 +1,97 @@
+import base64
+import hashlib
+import os
+
+import pytest
+
+import mintSources
+from mintSources import KeyFetcher, read_keyring_data
+
+def packet(tag, body):
+    # New format packet (RFC 4880 section 4.2.2), with a one-octet length
+    return bytes([0xc0 | tag, len(body)]) + body
+
+def make_key(name):
+    # Returns (fingerprint, key packets). Nothing checks the signatures, so a made up v4 key will do.
+    body = b"\x04" + (1700000000).to_bytes(4, "big") + b"\x16" + hashlib.sha256(name.encode()).digest()
+    fingerprint = hashlib.sha1(b"\x99" + len(body).to_bytes(2, "big") + body).hexdigest().upper()
+    key = packet(6, body) + packet(13, ("%s <%s@example.com>" % (name, name)).encode()) + packet(2, b"\x04signature") + packet(14, body[:-1] + b"\x01")
+    return (fingerprint, key)
+
+def armor(data):
+    return b"-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n" + base64.encodebytes(data) + b"=AAAA\n-----END PGP PUBLIC KEY BLOCK-----\n"
+
+(FINGERPRINT, KEY) = make_key("requested")
+(OTHER_FINGERPRINT, OTHER_KEY) = make_key("other")
+(THIRD_FINGERPRINT, THIRD_KEY) = make_key("third")
+
+@pytest.fixture
+def keyserver(stand_in_server, tmp_path, monkeypatch):
+    # An HKP stand-in answering every lookup with keyserver.reply, and a KeyFetcher using it
+    trusted_dir = tmp_path / "trusted.gpg.d"
+    trusted_dir.mkdir()
+    monkeypatch.setattr(mintSources, "TRUSTED_KEYRINGS_DIR", str(trusted_dir))
+    def handle(method, path, headers):
+        if server.reply is None:
+            return (404, {}, b"No results found")
+        return (200, {"Content-Type": "application/pgp-keys"}, server.reply)
+    server = stand_in_server(handle)
+    server.reply = None
+    server.trusted_dir = str(trusted_dir)
+    server.fetcher = KeyFetcher(keyserver=server.url, cache_dir=str(tmp_path / "cache"), retries=1)
+    return server
+
+def installed_keys(keyserver):
+    keys = {}
+    for file in os.listdir(keyserver.trusted_dir):
+        with open(os.path.join(keyserver.trusted_dir, file), "rb") as key_file:
+            keys[file] = key_file.read()
+    return keys
+
+def test_installs_the_requested_key(keyserver):
+    keyserver.reply = armor(KEY)
+    assert keyserver.fetcher.install([FINGERPRINT[-8:]]) == {}
+    assert installed_keys(keyserver) == {"mintsources-%s.gpg" % FINGERPRINT: KEY}
+    assert "search=0x%s" % FINGERPRINT[-8:] in keyserver.requests[0][1]
+
+@pytest.mark.parametrize("reply", [OTHER_KEY + KEY + THIRD_KEY, armor(OTHER_KEY + KEY + THIRD_KEY), armor(OTHER_KEY) + armor(KEY)])
+def test_extra_keys_in_the_reply_are_not_installed(keyserver, reply):
+    keyserver.reply = reply
+    assert keyserver.fetcher.install([FINGERPRINT]) == {}
+    keys = installed_keys(keyserver)
+    assert keys == {"mintsources-%s.gpg" % FINGERPRINT: KEY}
+    assert [fingerprint for (fingerprint, uid) in read_keyring_data(keys["mintsources-%s.gpg" % FINGERPRINT])] == [FINGERPRINT]
+
+def test_non_matching_key_is_rejected(keyserver):
+    keyserver.reply = armor(OTHER_KEY + THIRD_KEY)
+    errors = keyserver.fetcher.install([FINGERPRINT[-16:]])
+    assert list(errors.keys()) == [FINGERPRINT[-16:]]
+    assert installed_keys(keyserver) == {}
+
+@pytest.mark.parametrize("reply", [
+    b"\xc6\x00",
+    b"\xc6",
+    b"\xc6\xff\x00\x00",
+    KEY[:-3],
+    KEY + b"\xc6",
+    b"not a key",
+    b"-----BEGIN PGP PUBLIC KEY BLOCK-----\n\n!!!not base64\n=AAAA\n-----END PGP PUBLIC KEY BLOCK-----\n",
+])
+def test_malformed_reply_is_rejected(keyserver, reply):
+    keyserver.reply = reply
+    errors = keyserver.fetcher.install([FINGERPRINT[-8:]])
+    assert list(errors.keys()) == [FINGERPRINT[-8:]]
+    assert installed_keys(keyserver) == {}
+
+def test_missing_key_is_reported(keyserver):
+    errors = keyserver.fetcher.install([FINGERPRINT[-8:]])
+    assert list(errors.keys()) == [FINGERPRINT[-8:]]
+
+def test_cached_key_needs_no_keyserver(keyserver):
+    keyserver.reply = armor(KEY + OTHER_KEY)
+    assert keyserver.fetcher.install([FINGERPRINT[-8:]]) == {}
+    keyserver.reply = None
+    os.unlink(os.path.join(keyserver.trusted_dir, "mintsources-%s.gpg" % FINGERPRINT))
+    assert keyserver.fetcher.install([FINGERPRINT[-8:]]) == {}
+    assert installed_keys(keyserver) == {"mintsources-%s.gpg" % FINGERPRINT: KEY}
+    assert len(keyserver.requests) == 1
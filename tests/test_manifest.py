@@ -0,0 +1,45 @@
+import pytest
+
+from mintSources import SourcesIndex, SourcesTransaction, read_manifest
+
+CONFIG = {"general": {"base_codename": "jammy", "use_ppas": "true"}}
+
+def write(path, text):
+    path.write_text(text)
+    return str(path)
+
+def transaction_for(tmp_path, text):
+    sources_index = SourcesIndex()
+    sources_index.load([write(tmp_path / "extra.list", text)])
+    return SourcesTransaction("vera", CONFIG, [], sources_index=sources_index)
+
+def test_empty_yaml_keys_read_as_empty(tmp_path):
+    pytest.importorskip("yaml")
+    manifest = read_manifest(write(tmp_path / "manifest.yaml", "add:\nremove:\nofficial:\n  mirror:\n"))
+    assert manifest["add"] == []
+    assert manifest["remove"] == []
+    assert manifest["enable"] == []
+    assert manifest["disable"] == []
+    assert manifest["official"] == {}
+
+def test_json_manifest(tmp_path):
+    manifest = read_manifest(write(tmp_path / "manifest.json", '{"add": ["ppa:owner/tools"], "official": {"mirror": "http://mirror.example"}}'))
+    assert manifest["add"] == ["ppa:owner/tools"]
+    assert manifest["official"] == {"mirror": "http://mirror.example"}
+
+@pytest.mark.parametrize("text", ['{"add": "ppa:owner/tools"}', '{"remove": [1]}', '{"official": []}', '[]'])
+def test_invalid_manifest(tmp_path, text):
+    with pytest.raises(SystemExit):
+        read_manifest(write(tmp_path / "manifest.json", text))
+
+def test_is_enabled(tmp_path):
+    transaction = transaction_for(tmp_path, "deb http://example.com/debian jammy main\n# deb http://example.com/other jammy main\n")
+    assert transaction.is_enabled("deb http://example.com/debian jammy main") is True
+    assert transaction.is_enabled("deb http://example.com/other jammy main") is False
+    assert transaction.is_enabled("deb http://example.com/missing jammy main") is None
+
+def test_get_deb_lines():
+    transaction = SourcesTransaction("vera", CONFIG, [], sources_index=SourcesIndex())
+    assert transaction.get_deb_lines("ppa:owner/tools") == ["deb http://ppa.launchpad.net/owner/tools/ubuntu jammy main",
+                                                            "deb-src http://ppa.launchpad.net/owner/tools/ubuntu jammy main"]
+    assert transaction.get_deb_lines("deb http://example.com/debian jammy main") == ["deb http://example.com/debian jammy main"]
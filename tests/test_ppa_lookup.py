@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+from mintSources import MeasurementCache, PPAException, get_ppa_info_from_lp
+
+LAST_MODIFIED = "Mon, 02 Oct 2023 10:00:00 GMT"
+
+@pytest.fixture
+def launchpad(stand_in_server):
+    # Stands in for both the Launchpad API and the PPA archive. launchpad.ppas maps
+    # "~owner/+archive/name" to (etag, info), launchpad.releases lists the supported releases.
+    def handle(method, path, headers):
+        if path.startswith("/api/"):
+            ppa = path[len("/api/"):]
+            if ppa not in server.ppas:
+                return (404, {}, b"")
+            (etag, info) = server.ppas[ppa]
+            if headers.get("If-None-Match") == etag:
+                return (304, {"ETag": etag}, b"")
+            return (200, {"ETag": etag, "Last-Modified": LAST_MODIFIED, "Content-Type": "application/json"}, json.dumps(info).encode())
+        release = path.rstrip("/").split("/")[-1]
+        return (200 if release in server.releases else 404, {}, b"")
+    server = stand_in_server(handle)
+    server.ppas = {"~owner/+archive/tools": ('"v1"', {"displayname": "Tools", "description": "Some tools", "web_link": "https://launchpad.net/~owner/+archive/ubuntu/tools"})}
+    server.releases = ["jammy"]
+    return server
+
+def lookup(launchpad, cache, owner="owner", name="tools", codename="jammy"):
+    return get_ppa_info_from_lp(owner, name, codename, cache=cache, api_url=launchpad.url + "/api", archive_url=launchpad.url + "/archive")
+
+def get_requests(launchpad, method):
+    return [(path, headers) for (request_method, path, headers) in launchpad.requests if request_method == method]
+
+def test_lookup_checks_the_release(launchpad):
+    info = lookup(launchpad, MeasurementCache(None, 3600, 10))
+    assert info["displayname"] == "Tools"
+    assert [path for (path, headers) in get_requests(launchpad, "GET")] == ["/api/~owner/+archive/tools"]
+    assert [path for (path, headers) in get_requests(launchpad, "HEAD")] == ["/archive/owner/tools/ubuntu/dists/jammy"]
+
+def test_fresh_answers_need_no_request(launchpad):
+    cache = MeasurementCache(None, 3600, 10)
+    lookup(launchpad, cache)
+    assert lookup(launchpad, cache)["displayname"] == "Tools"
+    assert len(launchpad.requests) == 2
+
+def test_stale_answers_are_revalidated(launchpad):
+    # With no TTL, every lookup revalidates, and the unchanged description comes back as 304
+    cache = MeasurementCache(None, 0, 10)
+    lookup(launchpad, cache)
+    assert lookup(launchpad, cache)["displayname"] == "Tools"
+    (path, headers) = get_requests(launchpad, "GET")[-1]
+    assert headers.get("If-None-Match") == '"v1"'
+    assert headers.get("If-Modified-Since") == LAST_MODIFIED
+
+def test_changed_answers_are_fetched_again(launchpad):
+    cache = MeasurementCache(None, 0, 10)
+    lookup(launchpad, cache)
+    launchpad.ppas["~owner/+archive/tools"] = ('"v2"', {"displayname": "New tools", "description": "", "web_link": ""})
+    assert lookup(launchpad, cache)["displayname"] == "New tools"
+    assert cache.get(launchpad.url + "/api/~owner/+archive/tools", "")["etag"] == '"v2"'
+
+def test_answers_persist_between_runs(launchpad, tmp_path):
+    path = str(tmp_path / "ppas.json")
+    lookup(launchpad, MeasurementCache(path, 3600, 10))
+    assert lookup(launchpad, MeasurementCache(path, 3600, 10))["displayname"] == "Tools"
+    assert len(launchpad.requests) == 2
+
+def test_unsupported_release(launchpad):
+    with pytest.raises(PPAException):
+        lookup(launchpad, MeasurementCache(None, 3600, 10), codename="trusty")
+
+def test_unknown_ppa(launchpad):
+    with pytest.raises(PPAException):
+        lookup(launchpad, MeasurementCache(None, 3600, 10), name="missing")
@@ -0,0 +1,69 @@
+import threading
+
+from mintSources import HttpClient, SpeedTestPool
+
+# Injected latency of the stand-in mirrors, in seconds
+LATENCY = 0.1
+
+def ok(method, path, headers):
+    return (200, {}, b"x" * 1024)
+
+class Jobs():
+    # Speed test jobs fetching the URLs, counting how many of them run at the same time
+    def __init__(self, urls):
+        self.urls = urls
+        self.http_client = HttpClient()
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def test(self, url):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            self.http_client.get(url)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    def run(self, pool):
+        pool.run([(url, self.test, (url,)) for url in self.urls])
+
+def start_mirrors(stand_in_server, nb_mirrors):
+    # 127.0.0.x are different hosts to the pool, but all of them are local
+    return [stand_in_server(ok, host="127.0.0.%d" % i, delay=LATENCY) for i in range(1, nb_mirrors + 1)]
+
+def test_one_job_per_host(stand_in_server):
+    mirrors = start_mirrors(stand_in_server, 3)
+    jobs = Jobs(["%s/%d" % (mirror.url, job) for job in range(4) for mirror in mirrors])
+    jobs.run(SpeedTestPool(max_workers=8, max_per_host=1))
+    for mirror in mirrors:
+        assert len(mirror.requests) == 4
+        assert mirror.max_active == 1
+    # Different hosts are still tested at the same time
+    assert jobs.max_active == 3
+
+def test_max_per_host(stand_in_server):
+    mirror = stand_in_server(ok, delay=LATENCY)
+    jobs = Jobs(["%s/%d" % (mirror.url, job) for job in range(6)])
+    jobs.run(SpeedTestPool(max_workers=8, max_per_host=2))
+    assert len(mirror.requests) == 6
+    assert mirror.max_active == 2
+
+def test_concurrency_bound(stand_in_server):
+    mirrors = start_mirrors(stand_in_server, 6)
+    jobs = Jobs([mirror.url for mirror in mirrors])
+    jobs.run(SpeedTestPool(max_workers=2, max_per_host=1))
+    assert sum(len(mirror.requests) for mirror in mirrors) == 6
+    assert jobs.max_active == 2
+
+def test_cancel_stops_the_remaining_jobs(stand_in_server):
+    mirror = stand_in_server(ok, delay=LATENCY)
+    pool = SpeedTestPool(max_workers=1, max_per_host=1)
+    http_client = HttpClient()
+    def test(url):
+        http_client.get(url)
+        pool.cancel()
+    pool.run([("%s/%d" % (mirror.url, job), test, ("%s/%d" % (mirror.url, job),)) for job in range(5)])
+    assert len(mirror.requests) == 1